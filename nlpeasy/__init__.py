@@ -10,4 +10,8 @@ from .pipeline import *  # noqa: F401,F403
 from .docker import *  # noqa: F401,F403
 from .elastic import *  # noqa: F401,F403
 from .html import *  # noqa: F401,F403
+from .sinks import *  # noqa: F401,F403
+from .stats import *  # noqa: F401,F403
+from .cache import *  # noqa: F401,F403
+from .checkpoint import *  # noqa: F401,F403
 from . import util  # noqa: F401,F403
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+"""Persistent cache for the results of expensive stages."""
+
+import hashlib
+import os
+import pickle
+import sqlite3
+import time
+
+from typing import Iterable, Mapping, Union
+
+
+class EnrichmentCache(object):
+    """A content-addressed cache of per-text enrichments stored in a SQLite file.
+
+    The entries are pickled values under string keys (see :meth:`key`).
+    If there are more than ``max_entries`` entries the least recently used ones are evicted.
+    Several processes may use the same file.
+
+    Parameters
+    ----------
+    path :
+        The SQLite file, created if it does not exist.
+    max_entries :
+        Maximal number of entries kept.
+    """
+
+    def __init__(self, path: Union[str, os.PathLike], max_entries: int = 1000000):
+        self._path = str(path)
+        self._max_entries = max_entries
+        self._conn = None
+        self._size = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(text: str, prefix: str = "") -> str:
+        """The key of a text: its hash together with a ``prefix`` identifying model and options."""
+        return hashlib.sha1(f"{prefix}\0{text}".encode("utf-8")).hexdigest()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self._path, timeout=60)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB, last_used REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+            self._conn.commit()
+            self._size = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        return self._conn
+
+    def get_many(self, keys: Iterable[str]) -> dict:
+        """The cached values of those ``keys`` that are in the cache. Counts hits and misses."""
+        keys = list(set(keys))
+        result = {}
+        now = time.time()
+        for start in range(0, len(keys), 500):
+            batch = keys[start : start + 500]  # noqa: E203
+            placeholders = ",".join("?" * len(batch))
+            rows = self.conn.execute(
+                f"SELECT key, value FROM entries WHERE key IN ({placeholders})", batch
+            ).fetchall()
+            for k, v in rows:
+                result[k] = pickle.loads(v)
+            if rows:
+                self.conn.executemany(
+                    "UPDATE entries SET last_used = ? WHERE key = ?", [(now, k) for k, _ in rows]
+                )
+        self.conn.commit()
+        self.hits += len(result)
+        self.misses += len(keys) - len(result)
+        return result
+
+    def put_many(self, items: Mapping[str, object]):
+        """Stores the values and evicts the least recently used entries if the cache is full."""
+        if not items:
+            return
+        now = time.time()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO entries (key, value, last_used) VALUES (?, ?, ?)",
+            [(k, pickle.dumps(v, protocol=pickle.HIGHEST_PROTOCOL), now) for k, v in items.items()],
+        )
+        self._size += len(items)
+        if self._size > self._max_entries:
+            self._size = self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            excess = self._size - self._max_entries
+            if excess > 0:
+                self.conn.execute(
+                    "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY last_used LIMIT ?)",
+                    (excess,),
+                )
+                self._size -= excess
+        self.conn.commit()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def clear(self):
+        self.conn.execute("DELETE FROM entries")
+        self.conn.commit()
+        self._size = 0
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def __getstate__(self):
+        # The connection is opened again in the worker process
+        state = self.__dict__.copy()
+        state["_conn"] = None
+        return state
+
+    def __repr__(self):
+        return f"EnrichmentCache({self._path!r}, hits={self.hits}, misses={self.misses})"
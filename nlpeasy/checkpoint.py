@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+"""Checkpoints of :meth:`~nlpeasy.Pipeline.process` runs, so that a restarted run skips the finished chunks."""
+
+import json
+import os
+import pickle
+import threading
+
+from typing import Callable, Iterable, List, Optional, Union
+
+
+class Checkpoint(object):
+    """Records in a directory which chunks of a run are completely done.
+
+    A chunk is done when it was enriched, handed to the result sink, and (if writing to Elasticsearch) all its
+    bulk requests were answered. The chunks are numbered in the order of the input, therefore a resumed run
+    needs the same input and the same ``batchsize``.
+
+    Parameters
+    ----------
+    path :
+        The directory, created if it does not exist.
+    batchsize :
+        The batch size of the run, it has to be the same as in the checkpoint.
+    index :
+        The Elasticsearch index of the run, it has to be the same as in the checkpoint.
+    """
+
+    FILE = "checkpoint.json"
+    STATS_FILE = "stats.pkl"
+
+    def __init__(self, path: Union[str, os.PathLike], batchsize: int, index: Optional[str] = None):
+        self._path = str(path)
+        os.makedirs(self._path, exist_ok=True)
+        self._lock = threading.Lock()
+        self._pending = {}
+        state = {}
+        if os.path.exists(os.path.join(self._path, self.FILE)):
+            with open(os.path.join(self._path, self.FILE)) as f:
+                state = json.load(f)
+        if state.get("batchsize", batchsize) != batchsize:
+            raise Exception(
+                f"The checkpoint {self._path} was written with batchsize={state['batchsize']}, "
+                f"resume with the same batchsize or use another checkpoint directory."
+            )
+        if state.get("index", index) != index:
+            raise Exception(f"The checkpoint {self._path} was written for the index {state['index']!r}, not {index!r}.")
+        self.batchsize = batchsize
+        self.index = index
+        self.write_index = state.get("write_index")
+        self._done = set(self._expand(state.get("done", [])))
+
+    def __contains__(self, chunk: int) -> bool:
+        return chunk in self._done
+
+    def __len__(self):
+        return len(self._done)
+
+    def start(self, chunk: int, parts: int, on_done: Optional[Callable[[], None]] = None):
+        """Chunk ``chunk`` is done after :meth:`part_done` was called ``parts`` times.
+
+        Then ``on_done()`` is called (holding the lock of the checkpoint, so only one at a time) before the
+        chunk is recorded, e.g. to add it to the statistics saved with :meth:`save_stats`.
+        """
+        with self._lock:
+            self._pending[chunk] = (parts, on_done)
+
+    def part_done(self, chunk: int):
+        """Called (from any thread) e.g. when the chunk was uploaded or handed to the result sink."""
+        with self._lock:
+            parts, on_done = self._pending[chunk]
+            if parts > 1:
+                self._pending[chunk] = (parts - 1, on_done)
+                return
+            del self._pending[chunk]
+            if on_done is not None:
+                on_done()
+            self._done.add(chunk)
+            self._save()
+
+    def mark_done(self, chunk: int):
+        self.start(chunk, 1)
+        self.part_done(chunk)
+
+    def set_write_index(self, write_index: str):
+        with self._lock:
+            self.write_index = write_index
+            self._save()
+
+    def _save(self):
+        state = {
+            "batchsize": self.batchsize,
+            "index": self.index,
+            "write_index": self.write_index,
+            "done": self._ranges(self._done),
+        }
+        # written to a temporary file and renamed, so a crash never leaves a broken checkpoint
+        tmp = os.path.join(self._path, self.FILE + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, os.path.join(self._path, self.FILE))
+
+    def save_stats(self, stats):
+        """Keeps the column statistics of the done chunks of the run."""
+        tmp = os.path.join(self._path, self.STATS_FILE + ".tmp")
+        with open(tmp, "wb") as f:
+            pickle.dump(stats, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, os.path.join(self._path, self.STATS_FILE))
+
+    def load_stats(self):
+        """The column statistics saved by :meth:`save_stats`, ``None`` if there are none."""
+        path = os.path.join(self._path, self.STATS_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    def remove(self):
+        """Deletes the checkpoint files (but not the directory), e.g. after the run finished."""
+        for name in (self.FILE, self.STATS_FILE):
+            if os.path.exists(os.path.join(self._path, name)):
+                os.remove(os.path.join(self._path, name))
+        self._done = set()
+        self.write_index = None
+
+    @staticmethod
+    def _ranges(chunks: Iterable[int]) -> List[List[int]]:
+        """Consecutive chunk numbers as ``[start, end)`` ranges."""
+        ranges = []
+        for i in sorted(chunks):
+            if ranges and ranges[-1][1] == i:
+                ranges[-1][1] = i + 1
+            else:
+                ranges.append([i, i + 1])
+        return ranges
+
+    @staticmethod
+    def _expand(ranges: Iterable[List[int]]) -> Iterable[int]:
+        for start, end in ranges:
+            yield from range(start, end)
+
+    def __repr__(self):
+        return f"Checkpoint({self._path!r}, done={self._ranges(self._done)})"
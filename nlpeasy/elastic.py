@@ -3,12 +3,21 @@
 """Main module."""
 
 
-from typing import Optional
+import contextlib
+import datetime
+import math
+import re
+
+from typing import Callable, Optional
 import elasticsearch
 from . import kibana
 from . import docker
 
-from .util import chunker, print_or_display, rm_nan_from_dict
+from .util import chunker, print_or_display, dumps_json, json_docs, Progbar, _time_ns
+
+DEFAULT_MAX_CHUNK_BYTES = 10 * 1024 * 1024
+# documents per primary shard when the number of shards is derived from the expected number of documents
+DOCS_PER_SHARD = 10 * 1000 * 1000
 
 
 def connect_elastic(
@@ -269,7 +278,16 @@ class ElasticStack(object):
         lang="english",
         delete_old=True,
         verbose=False,
+        shards=None,
+        replicas=None,
+        expected_docs=None,
     ):
+        """Creates the index with mappings for the columns (or only puts the mappings if ``create=False``).
+
+        ``shards`` and ``replicas`` set the number of primary shards and replicas of a new index, by default
+        those of Elasticsearch. If ``shards`` is not given but ``expected_docs`` is, one primary shard per
+        ``DOCS_PER_SHARD`` documents is used.
+        """
         # assert lang == 'english'
         properties = {}
         for k in text_cols:
@@ -329,6 +347,12 @@ class ElasticStack(object):
                 },
                 "mappings": mapping,
             }
+            if shards is None and expected_docs is not None:
+                shards = max(1, math.ceil(expected_docs / DOCS_PER_SHARD))
+            if shards is not None:
+                body["settings"]["number_of_shards"] = shards
+            if replicas is not None:
+                body["settings"]["number_of_replicas"] = replicas
             if verbose:
                 print(body)
             if delete_old:
@@ -351,23 +375,66 @@ class ElasticStack(object):
         id_col=None,
         suggest_col=None,
         progbar=True,
-    ):
-        if id_col is None:
-            id_col = texts.index
+        bulk=True,
+        max_chunk_bytes=DEFAULT_MAX_CHUNK_BYTES,
+        raise_on_error=False,
+    ) -> Optional["BulkResult"]:
+        """Index the rows of a dataframe as documents.
+
+        Parameters
+        ----------
+        index :
+            Name of the Elasticsearch index.
+        texts :
+            The dataframe whose rows are indexed.
+        doctype :
+            Not used anymore with Elasticsearch 7+.
+        delete_old :
+            Delete the index first.
+        chunksize :
+            Maximal number of documents per bulk request.
+        id_col :
+            Name of the column holding the document IDs. If ``None`` the dataframe index is used.
+        suggest_col :
+            Name of the column copied into the ``suggest`` field.
+        progbar :
+            Display a progress bar.
+        bulk :
+            If ``True`` (default) use the ``_bulk`` API (see :meth:`bulk_docs`),
+            else index one document per request.
+        max_chunk_bytes :
+            Maximal size of the body of a bulk request.
+        raise_on_error :
+            Raise a :class:`BulkIndexError` if any document could not be indexed.
+
+        Returns
+        -------
+        BulkResult
+            The per-document outcome if ``bulk`` is ``True``.
+        """
         if delete_old:
             try:
                 self.es.indices.delete(index)
             except:  # noqa: E722
                 pass
         # createIndex(index=index, create=deleteOld)
+        if bulk:
+            return self.bulk_docs(
+                index,
+                texts,
+                id_col=id_col,
+                suggest_col=suggest_col,
+                chunksize=chunksize,
+                max_chunk_bytes=max_chunk_bytes,
+                progbar=progbar,
+                raise_on_error=raise_on_error,
+            )
 
+        if id_col is None:
+            id_col = texts.index
         for ic, cdf in enumerate(chunker(texts, chunksize, progbar=progbar)):
-            docs = cdf.to_dict(orient="records")
-            for ii, doc in enumerate(docs):
+            for ii, doc in enumerate(json_docs(cdf, suggest_col)):
                 i = ic * chunksize + ii
-                doc = rm_nan_from_dict(doc)
-                if suggest_col and suggest_col in doc:
-                    doc["suggest"] = doc[suggest_col]
                 try:
                     self.es.index(index=index, id=id_col[i], body=doc)
                 except Exception as ex:
@@ -378,6 +445,178 @@ class ElasticStack(object):
                     print(ex.error)
                     print("=" * 80)
 
+    def bulk_docs(
+        self,
+        index,
+        texts,
+        id_col=None,
+        suggest_col=None,
+        chunksize=1000,
+        max_chunk_bytes=DEFAULT_MAX_CHUNK_BYTES,
+        progbar=True,
+        raise_on_error=False,
+    ) -> "BulkResult":
+        """Index the rows of a dataframe using the ``_bulk`` API.
+
+        The documents are sent in requests of at most ``chunksize`` documents and ``max_chunk_bytes`` bytes.
+        Failures are not printed but collected per document in the returned :class:`BulkResult`.
+        """
+        result = BulkResult()
+        if progbar:
+            pbar = Progbar(len(texts))
+            pbar.update(0)
+        for body, ids in self.bulk_requests(
+            index,
+            texts,
+            id_col=id_col,
+            suggest_col=suggest_col,
+            chunksize=chunksize,
+            max_chunk_bytes=max_chunk_bytes,
+        ):
+            result.update(self.send_bulk(body, ids))
+            if progbar:
+                pbar.add(len(ids))
+        if raise_on_error and result.failed:
+            raise BulkIndexError(result)
+        return result
+
+    def bulk_requests(
+        self,
+        index,
+        texts,
+        id_col=None,
+        suggest_col=None,
+        chunksize=1000,
+        max_chunk_bytes=DEFAULT_MAX_CHUNK_BYTES,
+    ):
+        """Serializes the rows of a dataframe into ``_bulk`` request bodies.
+
+        Yields
+        ------
+        Tuples ``(body, ids)`` of the newline delimited request body and the document IDs it contains.
+        A single document larger than ``max_chunk_bytes`` is still sent on its own.
+        """
+        ids = texts.index if id_col is None else texts[id_col]
+        lines, chunk_ids, size = [], [], 0
+        for _id, doc in zip(ids, json_docs(texts, suggest_col)):
+            _id = str(_id)
+            data = dumps_json({"index": {"_index": index, "_id": _id}}) + b"\n" + doc + b"\n"
+            if chunk_ids and (
+                len(chunk_ids) >= chunksize or size + len(data) > max_chunk_bytes
+            ):
+                yield b"".join(lines), chunk_ids
+                lines, chunk_ids, size = [], [], 0
+            lines.append(data)
+            chunk_ids.append(_id)
+            size += len(data)
+        if chunk_ids:
+            yield b"".join(lines), chunk_ids
+
+    def send_bulk(self, body, ids) -> "BulkResult":
+        """Sends one ``_bulk`` request body and reports the outcome for each document in it."""
+        result = BulkResult(requests=1)
+        try:
+            resp = self.es.bulk(body=body)
+        except elasticsearch.TransportError as ex:
+            for _id in ids:
+                result.add_error(_id, ex.status_code, ex.error)
+            return result
+        for item in resp["items"]:
+            op, info = next(iter(item.items()))
+            if 200 <= info.get("status", 500) < 300:
+                result.success += 1
+            else:
+                result.add_error(info.get("_id"), info.get("status"), info.get("error"))
+        return result
+
+    @contextlib.contextmanager
+    def ingest_mode(self, index, forcemerge=False, max_num_segments=1):
+        """Context manager that tunes an index for bulk loading.
+
+        Refreshing is switched off and the replicas are set to ``0`` while the context is active.
+        Afterwards, also if the loading failed, the previous settings are restored and the index is refreshed.
+        If ``forcemerge`` is ``True`` and the loading succeeded the index is force-merged to ``max_num_segments``
+        segments, which makes searching a read-mostly index faster.
+
+        Example
+        -------
+        >>> with elk.ingest_mode("texts"):
+        ...     elk.load_docs("texts", df)
+        """
+        keys = ["refresh_interval", "number_of_replicas"]
+        settings = next(iter(self.es.indices.get_settings(index=index).values()))["settings"]["index"]
+        # settings that were not set explicitly are reset to the default by null
+        previous = {k: settings.get(k) for k in keys}
+        self.es.indices.put_settings(index=index, body={"index": {"refresh_interval": "-1", "number_of_replicas": 0}})
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.es.indices.put_settings(index=index, body={"index": previous})
+            self.es.indices.refresh(index=index)
+            if ok and forcemerge:
+                self.es.indices.forcemerge(index=index, max_num_segments=max_num_segments)
+
+    def versioned_index(self, alias):
+        """A new timestamped name for a version of the index behind ``alias``, see :meth:`swap_alias`."""
+        return f"{alias}-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f')}"
+
+    def swap_alias(self, alias, index, keep=2):
+        """Points ``alias`` atomically to ``index`` (and only to it).
+
+        If there is a concrete index named ``alias`` (e.g. written before aliases were used),
+        it is deleted in the same atomic step.
+        Afterwards only the ``keep`` newest versions named by :meth:`versioned_index` are kept
+        (``None`` keeps all).
+        """
+        actions = []
+        if self.es.indices.exists_alias(name=alias):
+            for old in self.es.indices.get_alias(name=alias):
+                actions.append({"remove": {"index": old, "alias": alias}})
+        elif self.es.indices.exists(index=alias):
+            actions.append({"remove_index": {"index": alias}})
+        actions.append({"add": {"index": index, "alias": alias}})
+        self.es.indices.update_aliases(body={"actions": actions})
+        if keep is not None:
+            self.delete_old_versions(alias, keep, current=index)
+
+    def delete_old_versions(self, alias, keep=2, current=None):
+        """Deletes all but the ``keep`` newest versions of the index behind ``alias`` (never ``current``)."""
+        pattern = re.compile(re.escape(alias) + r"-\d{8}-\d{6}-\d{6}")
+        versions = sorted(_ for _ in self.es.indices.get(index=f"{alias}-*") if pattern.fullmatch(_))
+        for old in versions[: max(0, len(versions) - keep)]:
+            if old != current:
+                self.delete_index(old)
+
+    def get_field(self, index, ids, field, chunksize=1000) -> dict:
+        """The value of ``field`` of the documents ``ids`` that exist and have it, fetched with ``_mget``."""
+        ids = [str(_) for _ in ids]
+        result = {}
+        for start in range(0, len(ids), chunksize):
+            chunk = ids[start : start + chunksize]  # noqa: E203
+            resp = self.es.mget(index=index, body={"ids": chunk}, _source=[field])
+            for doc in resp["docs"]:
+                if doc.get("found") and field in doc.get("_source", {}):
+                    result[doc["_id"]] = doc["_source"][field]
+        return result
+
+    def all_ids(self, index):
+        """The IDs of all documents of the index (scrolling through it)."""
+        from elasticsearch.helpers import scan
+
+        return (hit["_id"] for hit in scan(self.es, index=index, query={"query": {"match_all": {}}}, _source=False))
+
+    def delete_docs(self, index, ids, chunksize=1000) -> "BulkResult":
+        """Deletes the documents ``ids`` with ``_bulk`` requests."""
+        result = BulkResult()
+        ids = [str(_) for _ in ids]
+        for start in range(0, len(ids), chunksize):
+            chunk = ids[start : start + chunksize]  # noqa: E203
+            body = b"".join(dumps_json({"delete": {"_index": index, "_id": _id}}) + b"\n" for _id in chunk)
+            result.update(self.send_bulk(body, chunk))
+        return result
+
     def truncate(self, index):
         self._es.delete_by_query(index, {"query": {"match_all": {}}})
 
@@ -403,6 +642,191 @@ class ElasticStack(object):
         self.kibana.show_kibana(how=how, *args, **kwargs)
 
 
+class BulkResult(object):
+    """Outcome of bulk indexing.
+
+    Attributes
+    ----------
+    success :
+        Number of documents indexed successfully.
+    errors :
+        One dict per failed document with its ``_id``, the HTTP ``status`` and the ``error`` reported.
+    requests :
+        Number of bulk requests sent.
+    """
+
+    def __init__(self, requests=0):
+        self.success = 0
+        self.errors = []
+        self.requests = requests
+
+    @property
+    def failed(self):
+        return len(self.errors)
+
+    def add_error(self, id, status, error):
+        self.errors.append({"_id": id, "status": status, "error": error})
+
+    def update(self, other: "BulkResult"):
+        self.success += other.success
+        self.errors.extend(other.errors)
+        self.requests += other.requests
+        return self
+
+    def __repr__(self):
+        return f"BulkResult(success={self.success}, failed={self.failed}, requests={self.requests})"
+
+
+class BulkWriter(object):
+    """Uploads dataframes with several ``_bulk`` requests in flight at once.
+
+    The rows given to :meth:`write` are serialized in the calling thread and the requests are sent from a pool of
+    ``threads`` threads. At most ``queue_size`` further requests wait for a free thread, :meth:`write` blocks
+    otherwise. Hence memory is capped at about ``(threads + queue_size) * max_chunk_bytes``.
+
+    Use it as a context manager or call :meth:`close` to wait for all requests to finish.
+
+    To see whether the producer of the rows or the upload is the bottleneck the writer records (in nanoseconds):
+    ``producer_stall`` the time :meth:`write` was blocked by a full queue,
+    ``consumer_stall`` the time no request was in flight between the first :meth:`write` and :meth:`close`,
+    and ``upload`` the time spent in requests summed over all threads.
+
+    Parameters
+    ----------
+    elk :
+        The ElasticStack to write to.
+    index :
+        Name of the Elasticsearch index.
+    threads :
+        Number of bulk requests in flight.
+    queue_size :
+        Number of serialized bulk requests waiting for a thread.
+    kwargs :
+        Passed to :meth:`ElasticStack.bulk_requests`
+    """
+
+    def __init__(self, elk: ElasticStack, index: str, threads: int = 2, queue_size: int = 2, **kwargs):
+        from concurrent.futures import ThreadPoolExecutor
+        import threading
+
+        assert threads >= 1, "BulkWriter needs at least one thread"
+        self._elk = elk
+        self._index = index
+        self._kwargs = kwargs
+        self._executor = ThreadPoolExecutor(max_workers=threads)
+        self._slots = threading.BoundedSemaphore(threads + max(queue_size, 0))
+        self._lock = threading.Lock()
+        self._exception = None
+        self._in_flight = 0
+        self._idle_since = None
+        self.result = BulkResult()
+        self.producer_stall = 0
+        self.consumer_stall = 0
+        self.upload = 0
+
+    def write(self, texts, callback: Optional[Callable[[], None]] = None):
+        """Queues the rows of ``texts`` for upload.
+
+        ``callback()`` is called (in a writer thread) once all requests with these rows were indexed without
+        failures, it is not called if a request raised or a document failed.
+        """
+        self._raise_exception()
+        ack = _Acknowledgement(callback) if callback is not None else None
+        for body, ids in self._elk.bulk_requests(self._index, texts, **self._kwargs):
+            if not self._slots.acquire(blocking=False):
+                start = _time_ns()
+                self._slots.acquire()
+                self.producer_stall += _time_ns() - start
+            with self._lock:
+                if self._idle_since is not None:
+                    self.consumer_stall += _time_ns() - self._idle_since
+                    self._idle_since = None
+                self._in_flight += 1
+            if ack is not None:
+                ack.add()
+            future = self._executor.submit(self._send_bulk, body, ids)
+            future.add_done_callback(self._done)
+            if ack is not None:
+                future.add_done_callback(ack.done)
+        if ack is not None:
+            ack.done()
+
+    def _send_bulk(self, body, ids):
+        start = _time_ns()
+        try:
+            return self._elk.send_bulk(body, ids)
+        finally:
+            with self._lock:
+                self.upload += _time_ns() - start
+
+    def _done(self, future):
+        try:
+            with self._lock:
+                self.result.update(future.result())
+        except Exception as ex:
+            self._exception = ex
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                if self._in_flight == 0:
+                    self._idle_since = _time_ns()
+            self._slots.release()
+
+    def _raise_exception(self):
+        if self._exception is not None:
+            ex, self._exception = self._exception, None
+            raise ex
+
+    def close(self) -> BulkResult:
+        """Waits for all requests to finish and returns the accumulated outcome."""
+        self._executor.shutdown(wait=True)
+        self._raise_exception()
+        return self.result
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._executor.shutdown(wait=True)
+        if exc_type is None:
+            self._raise_exception()
+
+
+class _Acknowledgement(object):
+    """Calls ``callback`` when all requests of one :meth:`BulkWriter.write` succeeded."""
+
+    def __init__(self, callback):
+        import threading
+
+        self._callback = callback
+        self._lock = threading.Lock()
+        # one for write itself, so the callback cannot fire before all requests were queued
+        self._pending = 1
+        self._failed = False
+
+    def add(self):
+        with self._lock:
+            self._pending += 1
+
+    def done(self, future=None):
+        with self._lock:
+            if future is not None:
+                if future.exception() is not None or future.result().failed:
+                    self._failed = True
+            self._pending -= 1
+            fire = self._pending == 0 and not self._failed
+        if fire:
+            self._callback()
+
+
+class BulkIndexError(Exception):
+    def __init__(self, result: BulkResult):
+        super(BulkIndexError, self).__init__(
+            f"{result.failed} document(s) failed to index, first error: {result.errors[0]!r}"
+        )
+        self.result = result
+
+
 __DEFAULT_STACK = None
 
 
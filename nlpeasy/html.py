@@ -37,29 +37,68 @@ def parse_html(
     rows = []
     progbar = Progbar(len(files))
     for i, fname in enumerate(files):
-        cols = {}
         # print(f"Parsing file {fname}")
         if limit is not None and limit <= i:
             break
-        with open(fname) as fp:
-            soup = bs4.BeautifulSoup(fp)
-        for k, v in select.items():
-            x = soup.select(v)
-            cols[k] = [_.get_text() for _ in x]
-        rows.append(cols)
-        if add_meta_names:
-            for meta in soup.find_all("meta"):
-                if "name" in meta.attrs and "content" in meta.attrs:
-                    n = meta_names_prefix + meta.attrs["name"]
-                    if n not in cols:
-                        cols[n] = []
-                    cols[n].append(meta.attrs["content"])
-        cols["body"] = soup.get_text()
-        for tag in tags:
-            cols[tag] = [_.get_text() for _ in soup.find_all(tag)]
-        cols["a"] = [_["href"] for _ in soup.find_all("a")]
+        rows.append(_parse_html_file(fname, select, add_meta_names, meta_names_prefix, tags))
         progbar.add(1)
+    return _rows_to_frame(rows, autounbox)
 
+
+def iter_parse_html(
+    file,
+    chunksize=1000,
+    select={},
+    limit=None,
+    autounbox=True,
+    add_meta_names=True,
+    meta_names_prefix="meta_",
+    tags=["h1", "h2", "h3", "b", "em"],
+):
+    """
+    Parse HTML from file like :func:`parse_html` but yield dataframes of ``chunksize`` files each.
+
+    This can be passed to :meth:`~nlpeasy.Pipeline.process` to enrich more files than fit in RAM:
+
+    >>> pipeline.process(iter_parse_html('./papers.nips.cc/paper/*.html', select={'message': 'p.abstract'}))
+
+    Unboxing of single values (``autounbox``) is decided per chunk. The index continues over the chunks.
+    """
+    files = glob.glob(file)
+    if limit is not None:
+        files = files[:limit]
+    for start in range(0, len(files), chunksize):
+        rows = [
+            _parse_html_file(fname, select, add_meta_names, meta_names_prefix, tags)
+            for fname in files[start : start + chunksize]  # noqa: E203
+        ]
+        df = _rows_to_frame(rows, autounbox)
+        df.index = pd.RangeIndex(start, start + len(df))
+        yield df
+
+
+def _parse_html_file(fname, select, add_meta_names, meta_names_prefix, tags):
+    cols = {}
+    with open(fname) as fp:
+        soup = bs4.BeautifulSoup(fp)
+    for k, v in select.items():
+        x = soup.select(v)
+        cols[k] = [_.get_text() for _ in x]
+    if add_meta_names:
+        for meta in soup.find_all("meta"):
+            if "name" in meta.attrs and "content" in meta.attrs:
+                n = meta_names_prefix + meta.attrs["name"]
+                if n not in cols:
+                    cols[n] = []
+                cols[n].append(meta.attrs["content"])
+    cols["body"] = soup.get_text()
+    for tag in tags:
+        cols[tag] = [_.get_text() for _ in soup.find_all(tag)]
+    cols["a"] = [_["href"] for _ in soup.find_all("a")]
+    return cols
+
+
+def _rows_to_frame(rows, autounbox):
     all_cols = set(k for _ in rows for k in _.keys())
     if autounbox:
         for col in all_cols:
@@ -1,16 +1,34 @@
 # -*- coding: utf-8 -*-
 
 """Main module."""
+import collections
+import contextlib
+import functools
+import hashlib
+import itertools
 import numbers
+import os
+import re
+import warnings
+import weakref
+from collections import OrderedDict
 
+import numpy as np
 import pandas as pd
 import spacy
+from spacy.attrs import POS, DEP, LEMMA, IDX
+from spacy.parts_of_speech import NAMES as POS_NAMES, IDS as POS_IDS
+from spacy.symbols import VERB
 
 from . import kibana
-from .util import chunker, Tictoc
+from .cache import EnrichmentCache
+from .checkpoint import Checkpoint
+from .sinks import ResultSink, make_sink
+from .stats import StatsCollector
+from .util import canonical_json_rows, iter_chunks, Tictoc
 
-from typing import Optional, List, Union, Mapping, Callable
-from .elastic import ElasticStack
+from typing import Optional, List, Union, Mapping, Callable, Iterable, Iterator
+from .elastic import ElasticStack, BulkResult, BulkWriter, DEFAULT_MAX_CHUNK_BYTES
 
 
 class Pipeline(object):
@@ -78,6 +96,8 @@ class Pipeline(object):
     ):
         self._pipeline = []
         self._index = index
+        # the physical index written to instead of the alias self._index, see if_index_exists="swap"
+        self._write_index = None
         self._doctype = doctype
         self._textCols = text_cols or []
         self._tagCols = tag_cols or []
@@ -94,6 +114,9 @@ class Pipeline(object):
         self.elk = elk
         self._tictoc = Tictoc(output="", additive=True)
         self._min_max = {}
+        self._stats = None
+        self._bulk_result = None
+        self._docs = DocStore()
 
     def add(self, x):
         self._pipeline.append(x)
@@ -109,7 +132,7 @@ class Pipeline(object):
     def setup_elastic(self, **kwargs):
         if self.elk is not None:
             self.elk.create_index(
-                self._index,
+                self._write_index or self._index,
                 self._doctype,
                 text_cols=self._textCols,
                 tag_cols=self._tagCols,
@@ -125,20 +148,14 @@ class Pipeline(object):
         if self._dateCol:
             vis_cols.append(kibana.DateHistogram(self._dateCol))
         for i in self._tagCols:
-            vis_cols.append(kibana.HorizontalBar(i))
+            size = 20
+            if self._stats is not None and i in self._stats and self._stats[i].distinct:
+                size = min(size, self._stats[i].distinct)
+            vis_cols.append(kibana.HorizontalBar(i, size))
         for i in self._textCols:
             vis_cols.append(kibana.TagCloud(i))
         for i in self._numCols:
-            interval = 0.1
-            if i in self._min_max:
-                min, max = self._min_max[i]
-                if not isinstance(min, numbers.Number) and not isinstance(
-                    max, numbers.Number
-                ):
-                    interval = (max - min) / 100
-                else:
-                    print(f"Trying to do a histogram on str values: {min!r} - {max!r}")
-            vis_cols.append(kibana.Histogram(i, interval))
+            vis_cols.append(kibana.Histogram(i, self._histogram_interval(i)))
         time_from, time_to = None, None
         if self._dateCol in self._min_max:
             time_from, time_to = self._min_max[self._dateCol]
@@ -153,6 +170,21 @@ class Pipeline(object):
             **kwargs,
         )
 
+    def _histogram_interval(self, col, bins=50):
+        """Interval for about ``bins`` bars between the 1% and 99% quantiles (or min and max) of the last process."""
+        interval = 0.1
+        lo, hi = self._min_max.get(col, (None, None))
+        if self._stats is not None and col in self._stats:
+            quantiles = self._stats[col].quantile([0.01, 0.99])
+            if quantiles is not None and quantiles[1] > quantiles[0]:
+                lo, hi = quantiles
+        if isinstance(lo, numbers.Number) and isinstance(hi, numbers.Number):
+            if hi > lo:
+                interval = float(hi - lo) / bins
+        elif lo is not None:
+            print(f"Trying to do a histogram on str values: {lo!r} - {hi!r}")
+        return interval
+
     def create_kibana_dashboard(self, **kwargs):
         """Creates a default Kibana dashboard.
 
@@ -172,13 +204,21 @@ class Pipeline(object):
 
     def process(
         self,
-        texts: pd.DataFrame,
+        texts: Union[pd.DataFrame, Iterable[pd.DataFrame], str],
         write_elastic: Optional[bool] = None,
         setup_elastic: Optional[bool] = None,
         if_index_exists = "error",
         batchsize: int = 1000,
-        return_processed: bool = True,
+        return_processed: Union[bool, str, ResultSink] = True,
         progbar: bool = True,
+        max_chunk_bytes: int = DEFAULT_MAX_CHUNK_BYTES,
+        write_threads: int = 2,
+        write_queue_size: int = 2,
+        n_workers: int = 0,
+        ingest_mode: Union[bool, str] = False,
+        keep_versions: int = 2,
+        delete_missing: bool = False,
+        checkpoint_dir: Optional[str] = None,
     ):
         """Runs all the texts through all stages, writes the enriched rows to ElasticSearch, and returns them.
 
@@ -186,6 +226,10 @@ class Pipeline(object):
         ----------
         texts :
             The texts to process. Should provide all the needed columns.
+            Either a dataframe, an iterable (e.g. a generator) of dataframes, or the path to a
+            CSV, JSON lines, or Parquet file, see :func:`~nlpeasy.util.iter_chunks`.
+            Only the latter two are streamed and never need to fit in RAM as a whole (if ``return_processed=False``),
+            e.g. use :func:`~nlpeasy.html.iter_parse_html` for many HTML files.
         write_elastic :
             If ``True`` will write to ``self.elk`` ElasticSearch.
             If ``(None)`` then this is only done if ``self.elk`` is not ``None``
@@ -194,6 +238,15 @@ class Pipeline(object):
             If ``"error"`` (default) it raises an Exception.
             If ``"overwrite"`` the existing index is deleted.
             If ``"append"`` the existing index is kept and no mappings are written (ToDo still write new mappings?).
+            If ``"update"`` only new rows and rows that changed since they were indexed (by a hash of their content
+            stored in the field ``CONTENT_HASH_COL``) are processed and indexed, keyed on ``id_col`` (or the index
+            of the dataframe). Unchanged rows are neither enriched nor returned. If ``delete_missing`` is ``True``,
+            documents whose ID is not in the input are deleted at the end.
+            Use ``"overwrite"`` or ``"swap"`` if the stages changed.
+            If ``"swap"`` a new timestamped index is written and at the end the index name of the pipeline
+            is made an alias pointing to it, in one atomic step, so the previous data stays searchable until then
+            and also if the processing fails. Kibana uses the alias, so it does not need to be set up again.
+            The ``keep_versions`` newest versions are kept.
             If ``(None)`` then this is only done if ``self.elk`` is not ``None``
         batchsize :
             Number of rows to process and possibly upload together.
@@ -202,34 +255,192 @@ class Pipeline(object):
             If this is too big, RAM might become an issue.
             Also the progressbar is only updated after each batch.
         return_processed :
-            Should the enriched dataframe be returned.
-            Setting it to ``False`` saves RAM.
+            Where the enriched rows go, see :func:`~nlpeasy.sinks.make_sink`:
+            ``True`` (default) returns one dataframe, ``False`` returns nothing and saves RAM.
+            The path of a ``.parquet`` or ``.arrow`` file (or a :class:`~nlpeasy.sinks.ResultSink`)
+            writes the batches to it one by one. Use :meth:`process_iter` to get the batches as a generator.
         progbar :
             Display a progress bar.
+        max_chunk_bytes :
+            Maximal size of the body of one bulk request to Elasticsearch.
+            The outcome of the upload is kept in ``bulk_result``.
+        write_threads :
+            Number of bulk requests to Elasticsearch in flight at once.
+            The uploads run in background threads and overlap with the enrichment of the next batch.
+            If ``0`` every batch is uploaded before the next one is enriched.
+        write_queue_size :
+            Number of serialized bulk requests waiting for an upload thread.
+            If the queue is full the enrichment waits, hence this caps the memory used for uploading.
+            The time the enrichment waited for uploads and the uploads waited for enrichment are reported as
+            ``elastic / stall ...`` in :meth:`summary`.
+        n_workers :
+            If bigger than ``0`` the stages run in a pool of this many processes.
+            Each worker builds its stages once (e.g. loads the spaCy model) and the batches are
+            enriched in parallel and returned in their original order.
+            The ``n_process`` pools of the stages are not used in the workers.
+        ingest_mode :
+            If ``True`` the index is tuned for bulk loading while writing (no refreshes and no replicas), see
+            :meth:`~nlpeasy.elastic.ElasticStack.ingest_mode`. Afterwards the settings are restored and the index
+            is refreshed. ``"forcemerge"`` also force-merges the index into one segment at the end.
+        checkpoint_dir :
+            If given, the numbers of the finished batches are recorded in this directory, see
+            :class:`~nlpeasy.checkpoint.Checkpoint`. A batch is finished when it was handed to the results and all
+            its bulk requests were acknowledged by Elasticsearch. If the run is restarted with the same input and
+            ``batchsize`` the finished batches are skipped (also the index is neither set up nor checked again),
+            hence the results only contain the remaining batches, except those written to a file, which keeps the
+            batches of the previous runs in ``checkpoint_dir`` until the end. Batches that were in flight are
+            processed again, with ``id_col`` set they overwrite the same documents, so re-runs are idempotent.
+            The checkpoint is removed when the run finished. The :attr:`stats` only count the finished batches,
+            also those of the previous runs.
 
         Returns
         -------
-            Enriched texts if ``returnProcessed=True``.
+            Enriched texts if ``returnProcessed=True``, or what the result sink returns.
 
         """
+        sink = make_sink(return_processed)
+        # a file sink keeps the batches of a checkpointed run, so the results of a resumed run are complete
+        numbered = checkpoint_dir is not None and sink is not None and sink.use_checkpoint(checkpoint_dir)
+        batches = self._process_numbered(
+            texts,
+            write_elastic=write_elastic,
+            setup_elastic=setup_elastic,
+            if_index_exists=if_index_exists,
+            batchsize=batchsize,
+            progbar=progbar,
+            max_chunk_bytes=max_chunk_bytes,
+            write_threads=write_threads,
+            write_queue_size=write_queue_size,
+            n_workers=n_workers,
+            ingest_mode=ingest_mode,
+            keep_versions=keep_versions,
+            delete_missing=delete_missing,
+            checkpoint_dir=checkpoint_dir,
+        )
+        try:
+            for number, x in batches:
+                if sink is not None:
+                    self.tic("global", "write results")
+                    if numbered:
+                        sink.write(x, number)
+                    else:
+                        sink.write(x)
+                    self.toc()
+        except BaseException:
+            batches.close()
+            if sink is not None:
+                sink.abort()
+            raise
+        if sink is None:
+            return None
+        self.tic("global", "close results")
+        results = sink.close()
+        self.toc()
+        return results
+
+    def process_iter(
+        self,
+        texts: Union[pd.DataFrame, Iterable[pd.DataFrame], str],
+        write_elastic: Optional[bool] = None,
+        setup_elastic: Optional[bool] = None,
+        if_index_exists="error",
+        batchsize: int = 1000,
+        progbar: bool = True,
+        max_chunk_bytes: int = DEFAULT_MAX_CHUNK_BYTES,
+        write_threads: int = 2,
+        write_queue_size: int = 2,
+        n_workers: int = 0,
+        ingest_mode: Union[bool, str] = False,
+        keep_versions: int = 2,
+        delete_missing: bool = False,
+        checkpoint_dir: Optional[str] = None,
+    ) -> Iterator[pd.DataFrame]:
+        """Like :meth:`process` but yields the enriched batches instead of collecting them.
+
+        Nothing is processed until the generator is consumed. See :meth:`process` for the parameters.
+        """
+        batches = self._process_numbered(
+            texts,
+            write_elastic=write_elastic,
+            setup_elastic=setup_elastic,
+            if_index_exists=if_index_exists,
+            batchsize=batchsize,
+            progbar=progbar,
+            max_chunk_bytes=max_chunk_bytes,
+            write_threads=write_threads,
+            write_queue_size=write_queue_size,
+            n_workers=n_workers,
+            ingest_mode=ingest_mode,
+            keep_versions=keep_versions,
+            delete_missing=delete_missing,
+            checkpoint_dir=checkpoint_dir,
+        )
+        try:
+            for _, x in batches:
+                yield x
+        finally:
+            batches.close()
+
+    def _process_numbered(
+        self,
+        texts,
+        write_elastic=None,
+        setup_elastic=None,
+        if_index_exists="error",
+        batchsize=1000,
+        progbar=True,
+        max_chunk_bytes=DEFAULT_MAX_CHUNK_BYTES,
+        write_threads=2,
+        write_queue_size=2,
+        n_workers=0,
+        ingest_mode=False,
+        keep_versions=2,
+        delete_missing=False,
+        checkpoint_dir=None,
+    ):
+        """Yields the enriched batches with their numbers in the checkpoint (``None`` without a checkpoint)."""
         if write_elastic is None:
             write_elastic = self.elk is not None
         assert not write_elastic or self.elk is not None, 'if write_elastic is True, there has to be a self.elk'
         if setup_elastic is None:
             setup_elastic = write_elastic
             # TODO by default only setup if index does not exist yet
-        if self._vec_types is None:
+        chunks = iter_chunks(texts, batchsize, progbar=progbar)
+        first = next(chunks, None)
+        if first is not None:
+            chunks = itertools.chain([first], chunks)
+        if self._vec_types is None and first is not None:
             self._vec_types = {}
             for _ in self._vec_cols:
                 self._vec_types[_] = {
-                    "dims": len(texts[_].iloc[0]),
+                    "dims": len(first[_].iloc[0]),
                     "similarity": "cosine",
                 }
-        if write_elastic and self.elk.es.indices.exists(index=self._index):
+        checkpoint = Checkpoint(checkpoint_dir, batchsize, self._index) if checkpoint_dir is not None else None
+        resume = checkpoint is not None and len(checkpoint) > 0
+        if resume:
+            print(f"resuming from the checkpoint in {checkpoint_dir}: {len(checkpoint)} batches are already done")
+            setup_elastic = False
+        swap = write_elastic and if_index_exists.lower() == "swap"
+        write_index = self._write_index = None
+        if swap:
+            if resume and checkpoint.write_index is not None:
+                write_index = self._write_index = checkpoint.write_index
+            else:
+                write_index = self._write_index = self.elk.versioned_index(self._index)
+            if checkpoint is not None:
+                checkpoint.set_write_index(write_index)
+            print(f"writing to the new index {write_index}, the alias {self._index} is swapped at the end")
+        elif resume:
+            pass
+        elif write_elastic and self.elk.es.indices.exists(index=self._index):
             _ = if_index_exists.lower()
             if _ == 'append':
                 print(f"index {self._index} already exists - thus we only index and do not set the mapping")
                 setup_elastic = False
+            elif _ == 'update':
+                print(f"index {self._index} already exists - only new and changed rows are processed and indexed")
+                setup_elastic = False
             elif _ == 'overwrite':
                 print(f"index {self._index} already exists - we will delete the previous one")
                 self.elk.delete_index(self._index)
@@ -237,62 +448,310 @@ class Pipeline(object):
                 raise Exception(f"index {self._index} already exists: either change the name of the index "
                                 "or use if_index_exists='append' or if_index_exists='overwrite'.")
             else:
-                raise Exception(f"if_index_exists has to be one of 'append', 'overwrite', or 'error', instead you used: {if_index_exists!r}")
+                raise Exception("if_index_exists has to be one of 'append', 'overwrite', 'swap', 'update', or 'error', "
+                                f"instead you used: {if_index_exists!r}")
         if setup_elastic:
-            self.setup_elastic()
-        results = []
+            self.setup_elastic(**({"expected_docs": len(texts)} if isinstance(texts, pd.DataFrame) else {}))
+        incremental = write_elastic and if_index_exists.lower() == "update"
+        seen = set() if incremental and delete_missing else None
+        numbers = None
+        if checkpoint is not None:
+            numbers = collections.deque()
+            chunks = self._unfinished_chunks(chunks, checkpoint, numbers, seen)
+        if incremental:
+            skipped = (lambda: checkpoint.mark_done(numbers.pop())) if checkpoint is not None else None
+            chunks = self._changed_rows(chunks, seen, skipped)
+        self._bulk_result = BulkResult() if write_elastic else None
+        self._min_max = {}
+        self._stats = checkpoint.load_stats() if resume else None
+        if self._stats is None:
+            self._stats = StatsCollector(
+                num_cols=self._numCols,
+                date_cols=[self._dateCol] if self._dateCol is not None else [],
+                tag_cols=self._tagCols,
+            )
+        with contextlib.ExitStack() as ingest:
+            if write_elastic and ingest_mode:
+                ingest.enter_context(
+                    self.elk.ingest_mode(write_index or self._index, forcemerge=ingest_mode == "forcemerge")
+                )
+            writer = None
+            if write_elastic and write_threads > 0:
+                writer = self.bulk_writer(
+                    threads=write_threads,
+                    queue_size=write_queue_size,
+                    chunksize=batchsize,
+                    max_chunk_bytes=max_chunk_bytes,
+                )
 
-        self.tic("global", "process")
-        for chunk in chunker(texts, batchsize, progbar=progbar):
-            x = chunk
-            for i, p in enumerate(self._pipeline):
-                if not progbar:
-                    print(f"Stage {i+1} of {len(self._pipeline)}: {p.name}")
-                self.tic(f"Stage {i+1}", p.name)
-                x = p.process(x)
+            self.tic("global", "process")
+            try:
+                for number, x in self._process_chunks(
+                    chunks,
+                    n_workers=n_workers,
+                    progbar=progbar,
+                    writer=writer,
+                    write_elastic=write_elastic,
+                    batchsize=batchsize,
+                    max_chunk_bytes=max_chunk_bytes,
+                    checkpoint=checkpoint,
+                    numbers=numbers,
+                ):
+                    if checkpoint is None:
+                        self.tic("global", "column stats")
+                        self._stats.update(x)
+                        self._min_max = self._stats.min_max()
+                        self.toc()
+                    yield number, x
+            finally:
+                for p in self._pipeline:
+                    p.close()
+                if writer is not None:
+                    self.tic("elastic", "wait for uploads")
+                    try:
+                        self._bulk_result = writer.close()
+                    finally:
+                        self.toc()
+                        self._tictoc.add("elastic / upload (summed over threads)", writer.upload)
+                        self._tictoc.add("elastic / stall enrichment waiting for upload", writer.producer_stall)
+                        self._tictoc.add("elastic / stall upload waiting for enrichment", writer.consumer_stall)
+                self.toc()
+                self._write_index = None
+        if swap:
+            self.elk.swap_alias(self._index, write_index, keep=keep_versions)
+        if seen is not None:
+            self.tic("elastic", "delete missing rows")
+            missing = [_ for _ in self.elk.all_ids(self._index) if _ not in seen]
+            if missing:
+                deleted = self.elk.delete_docs(self._index, missing)
+                print(f"{deleted.success} documents not in the input were deleted")
+            self.toc()
+        if write_elastic and self._bulk_result.failed:
+            print(
+                f"{self._bulk_result.failed} documents could not be indexed, see bulk_result.errors"
+            )
+        elif checkpoint is not None:
+            checkpoint.remove()
+
+    def _unfinished_chunks(self, chunks, checkpoint, numbers, seen=None):
+        """Yields the chunks not done according to ``checkpoint`` and appends their numbers to ``numbers``.
+
+        The IDs of the skipped chunks are added to ``seen``, so they are not deleted as missing.
+        """
+        for i, chunk in enumerate(chunks):
+            if i in checkpoint:
+                if seen is not None:
+                    seen.update(self._row_ids(chunk))
+                continue
+            numbers.append(i)
+            yield chunk
+
+    def _changed_rows(self, chunks, seen=None, skipped=None):
+        """Yields only the rows of the chunks that are new or changed since they were indexed.
+
+        The rows get their content hash in the column ``CONTENT_HASH_COL``, which is compared to the one stored
+        in the index. The IDs of all rows are added to ``seen``. ``skipped()`` is called for each chunk without
+        changed rows.
+        """
+        for chunk in chunks:
+            self.tic("elastic", "compare content hashes")
+            hashes = _content_hashes(chunk)
+            ids = self._row_ids(chunk)
+            if seen is not None:
+                seen.update(ids)
+            stored = self.elk.get_field(self._index, ids, CONTENT_HASH_COL)
+            changed = (hashes.to_numpy() != ids.map(stored).to_numpy())
+            self._tictoc.count("elastic / unchanged rows skipped", int((~changed).sum()))
+            self.toc()
+            if changed.any():
+                chunk = chunk[changed].copy(deep=False)
+                chunk[CONTENT_HASH_COL] = hashes.to_numpy()[changed]
+                yield chunk
+            elif skipped is not None:
+                skipped()
+
+    def _row_ids(self, chunk) -> pd.Series:
+        """The Elasticsearch IDs of the rows: ``id_col`` or the index of the dataframe, as strings."""
+        return pd.Series(chunk.index if self._idCol is None else chunk[self._idCol].to_numpy()).astype(str)
+
+    def _process_chunks(
+        self, chunks, n_workers, progbar, writer, write_elastic, batchsize, max_chunk_bytes,
+        checkpoint=None, numbers=None,
+    ):
+        """Runs each chunk through all stages, uploads it, and yields its number and the enriched chunk.
+
+        With a ``checkpoint`` the chunk (numbered by the head of ``numbers``) is done once the upload was
+        acknowledged and the consumer asked for the next chunk.
+        """
+        if n_workers > 0:
+            enriched = self._enrich_parallel(chunks, n_workers)
+        else:
+            enriched = (self._enrich(chunk, verbose=not progbar) for chunk in chunks)
+        for x in enriched:
+            number = done = None
+            if checkpoint is not None:
+                number = numbers.popleft()
+                # with a checkpoint the statistics only count done chunks, so a resumed run counts every row once
+                stats_cols = [_ for _ in x.columns if _ in self._stats]
+                checkpoint.start(
+                    number,
+                    2 if write_elastic else 1,
+                    on_done=functools.partial(self._chunk_done, checkpoint, x[stats_cols]),
+                )
+                done = functools.partial(checkpoint.part_done, number)
+            if writer is not None:
+                self.tic("elastic", "serialize and queue")
+                writer.write(self._upload_frame(x), callback=done)
                 self.toc()
-            if write_elastic:
-                self.write_elastic(
+            elif write_elastic:
+                result = self.write_elastic(
                     x,
                     chunksize=batchsize,
                     progbar=not progbar,
                     set_kibana_time_default=False,
+                    max_chunk_bytes=max_chunk_bytes,
                 )
-            if return_processed:
-                results.append(x)
-        self.toc()
-        # return results
-        self.tic("global", "concat results")
-        if return_processed:
-            results = pd.concat(results, sort=False)
-        else:
-            results = None
-        self.toc()
+                self._bulk_result.update(result)
+                if done is not None and not result.failed:
+                    done()
+            yield number, x
+            if done is not None:
+                done()
+
+    def _chunk_done(self, checkpoint, x):
+        """Adds a done chunk to the statistics and saves them with the checkpoint (possibly in an upload thread)."""
+        self._stats.update(x)
+        self._min_max = self._stats.min_max()
+        checkpoint.save_stats(self._stats)
+
+    def _enrich(self, x, verbose=False):
+        """Runs one chunk through all stages.
+
+        The new columns of each stage are concatenated to the chunk in one step, so the existing columns are
+        neither copied nor changed. Stages that override :meth:`PipelineStage.process` get and return whole frames.
+        """
+        x = x.copy(deep=False)
+        self._docs.start(x)
+        try:
+            for i, p in enumerate(self._pipeline):
+                if verbose:
+                    print(f"Stage {i+1} of {len(self._pipeline)}: {p.name}")
+                self.tic(f"Stage {i+1}", p.name)
+                if type(p).process is PipelineStage.process:
+                    x = _append_columns(x, p.new_columns(x))
+                else:
+                    x = p.process(x)
+                # later stages get the texts of the docs they parse from the new frame
+                self._docs.set_chunk(x)
+                self.toc()
+        finally:
+            # the docs are not needed for writing the chunk
+            self._docs.clear()
+        return x
+
+    def _enrich_parallel(self, chunks, n_workers):
+        """Enriches the chunks in a pool of processes and yields them in order.
 
-        self.tic("global", "min_max_calc")
-        # Need to keep track of ranges for kibana to have something ot work on
-        cols = self._numCols.copy()
-        if self._dateCol is not None:
-            cols.append(self._dateCol)
-        if return_processed:
-            for i in cols:
-                self._min_max[i] = (results.loc[:, i].min(), results.loc[:, i].max())
+        At most ``2 * n_workers`` chunks are submitted at once to bound the memory.
+        """
+        from collections import deque
+        from concurrent.futures import ProcessPoolExecutor
+        import multiprocessing
+
+        nested = [p.name for p in self._pipeline if getattr(p, "_n_process", 1) > 1]
+        if nested:
+            warnings.warn(f"n_process of the stages {nested} is ignored with n_workers: they run in the workers")
+        pending = deque()
+        with ProcessPoolExecutor(
+            max_workers=n_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self._pipeline,),
+        ) as executor:
+            for chunk in chunks:
+                if len(pending) >= 2 * n_workers:
+                    yield self._collect_worker_result(pending.popleft())
+                pending.append(executor.submit(_enrich_in_worker, chunk))
+            while pending:
+                yield self._collect_worker_result(pending.popleft())
+
+    def _collect_worker_result(self, future):
+        self.tic("global", "wait for workers")
+        x, timings, counters = future.result()
         self.toc()
+        for name, dur in timings.items():
+            self._tictoc.add(name, dur)
+        for name, n in counters.items():
+            self._tictoc.count(name, n)
+        return x
 
-        return results
+    def bulk_writer(self, threads: int = 2, queue_size: int = 2, **kwargs) -> BulkWriter:
+        """Creates a :class:`~nlpeasy.elastic.BulkWriter` for the index of this pipeline.
+
+        Parameters
+        ----------
+        threads :
+            Number of bulk requests in flight.
+        queue_size :
+            Number of serialized bulk requests waiting for a thread.
+        kwargs :
+            Passed to :meth:`~nlpeasy.elastic.ElasticStack.bulk_requests`
+        """
+        return BulkWriter(
+            self.elk,
+            self._write_index or self._index,
+            threads=threads,
+            queue_size=queue_size,
+            id_col=self._idCol,
+            suggest_col=self._suggests,
+            **kwargs,
+        )
+
+    def _upload_frame(self, texts):
+        return texts.drop(columns=self._ignoreUploadCols, errors="ignore")
 
     def write_elastic(
-        self, texts, set_kibana_time_default=True, chunksize=1000, progbar=True
-    ):
+        self,
+        texts,
+        set_kibana_time_default=True,
+        chunksize=1000,
+        progbar=True,
+        bulk=True,
+        max_chunk_bytes=DEFAULT_MAX_CHUNK_BYTES,
+    ) -> Optional[BulkResult]:
+        """Writes the rows to the Elasticsearch index of this pipeline.
+
+        Parameters
+        ----------
+        texts :
+            The (enriched) rows to write.
+        set_kibana_time_default :
+            Set the default time range in Kibana to the range of ``date_col``.
+        chunksize :
+            Maximal number of documents per bulk request.
+        progbar :
+            Display a progress bar.
+        bulk :
+            Use the ``_bulk`` API (default) instead of one request per document.
+        max_chunk_bytes :
+            Maximal size of the body of a bulk request.
+
+        Returns
+        -------
+        BulkResult
+            The per-document outcome if ``bulk`` is ``True``.
+        """
         self.tic("elastic", "upload")
-        self.elk.load_docs(
-            index=self._index,
+        result = self.elk.load_docs(
+            index=self._write_index or self._index,
             doctype=self._doctype,
             id_col=self._idCol,
             suggest_col=self._suggests,
-            texts=texts.drop(columns=self._ignoreUploadCols, errors="ignore"),
+            texts=self._upload_frame(texts),
             chunksize=chunksize,
             progbar=progbar,
+            bulk=bulk,
+            max_chunk_bytes=max_chunk_bytes,
         )
         self.toc()
         if set_kibana_time_default and self._dateCol is not None:
@@ -300,6 +759,26 @@ class Pipeline(object):
                 time_from=str(texts[self._dateCol].min()),
                 time_to=str(texts[self._dateCol].max()),
             )
+        return result
+
+    @property
+    def stats(self) -> Optional[StatsCollector]:
+        """Statistics of the numeric, date, and tag columns collected during the last :meth:`process`."""
+        return self._stats
+
+    @property
+    def docs(self) -> "DocStore":
+        """The spaCy docs of the chunk that is being enriched, see :class:`DocStore`."""
+        return self._docs
+
+    @property
+    def bulk_result(self) -> Optional[BulkResult]:
+        """The outcome of the Elasticsearch upload of the last :meth:`process`."""
+        return self._bulk_result
+
+    def summary(self):
+        """Prints the time spent in the parts of the pipeline, summed over all calls of :meth:`process`."""
+        self._tictoc.summary()
 
     def tic(self, part, name):
         self._tictoc.tic(f"{part} / {name}")
@@ -308,22 +787,214 @@ class Pipeline(object):
         self._tictoc.toc()
 
 
+_WORKER_PIPELINE = None
+
+
+def _init_worker(stages):
+    """Builds the stages once per worker process of :meth:`Pipeline.process` with ``n_workers``."""
+    global _WORKER_PIPELINE
+    _WORKER_PIPELINE = Pipeline(index=None)
+    for stage in stages:
+        # the workers run in parallel already, and pools of their own would keep them from shutting down
+        if getattr(stage, "_n_process", 1) > 1:
+            stage._n_process = 1
+        _WORKER_PIPELINE.add(stage)
+
+
+def _enrich_in_worker(chunk):
+    x = _WORKER_PIPELINE._enrich(chunk)
+    tictoc = _WORKER_PIPELINE._tictoc
+    timings, counters = dict(tictoc._summarizer), dict(tictoc._counters)
+    tictoc._summarizer.clear()
+    tictoc._counters.clear()
+    return x, timings, counters
+
+
+# the field with the content hash of the input row, see if_index_exists="update"
+CONTENT_HASH_COL = "nlpeasy_content_hash"
+
+
+def _content_hashes(chunk):
+    """A hash of the content of each row (as hex strings) that is stable across processes, runs, and chunks.
+
+    The rows are hashed in the form of :func:`~nlpeasy.util.canonical_json_rows`, so a row gets the same hash
+    whatever types pandas inferred for the other rows of its chunk.
+    """
+    hashes = [hashlib.blake2b(_, digest_size=8).hexdigest() for _ in canonical_json_rows(chunk)]
+    return pd.Series(hashes, index=chunk.index, dtype=object)
+
+
+def _append_columns(text, columns):
+    """The chunk with the new columns added in one step (Series are aligned on the index).
+
+    The new columns become one frame that is concatenated to the chunk, so it is not fragmented by many
+    single inserts and its existing columns are not copied. Columns the chunk already has are replaced in place.
+    """
+    new = {}
+    for k, v in columns.items():
+        if isinstance(v, pd.Series):
+            v = (v if v.index.equals(text.index) else v.reindex(text.index)).array
+        if k in text.columns:
+            text[k] = v
+        else:
+            new[k] = v
+    if not new:
+        return text
+    return pd.concat([text, pd.DataFrame(new, index=text.index)], axis=1)
+
+
+class DocStore(object):
+    """The spaCy docs of the chunk that is being enriched, per text column.
+
+    :class:`SpacyEnrichment` puts its docs here, so later stages of the same chunk can use them
+    (e.g. a second :class:`SpacyEnrichment` with other options, or custom stages working on the docs)
+    without parsing the texts again and without keeping docs in the dataframe like ``return_doc=True``.
+    Docs are only kept if a later stage needs them (see :meth:`PipelineStage.needs_docs`), otherwise they are
+    freed as soon as the stage extracted its enrichments. The store is emptied before the chunk is written.
+    Docs are positional (one per row of the chunk) and ``None`` where the stage took the row from its cache.
+    """
+
+    def __init__(self):
+        self._chunk = None
+        self._texts = {}
+        self._docs = {}
+        self._sentences = {}
+
+    def start(self, chunk: pd.DataFrame):
+        self.clear()
+        self._chunk = chunk
+
+    def set_chunk(self, chunk: pd.DataFrame):
+        """Replaces the chunk by the frame with the columns of the last stage, keeping the docs of its rows."""
+        self._chunk = chunk
+
+    def clear(self):
+        self._chunk = None
+        self._texts = {}
+        self._docs = {}
+        self._sentences = {}
+
+    def put(self, col: str, docs: List, nlp: Callable, disable: Iterable[str] = ()):
+        """Stores the docs of column ``col`` parsed by ``nlp`` with the components ``disable`` disabled."""
+        self._docs[col] = (nlp, frozenset(disable), list(docs))
+
+    def get(
+        self,
+        col: str,
+        nlp: Optional[Callable] = None,
+        rows: Optional[Iterable[int]] = None,
+        disable: Iterable[str] = (),
+        **kwargs,
+    ) -> Optional[List]:
+        """The docs of column ``col`` of the current chunk.
+
+        Without ``nlp`` the stored docs (``None`` if there are none).
+        With ``nlp`` the docs of ``rows`` (all if not given) are taken from the store or parsed as in
+        :meth:`parse`, and stored for later stages.
+        """
+        if nlp is None:
+            return self._docs.get(col, (None, None, None))[2]
+        for _ in self.parse(col, nlp, rows=rows, disable=disable, keep=True, **kwargs):
+            pass
+        return self._docs[col][2]
+
+    def parse(
+        self,
+        col: str,
+        nlp: Callable,
+        rows: Optional[Iterable[int]] = None,
+        disable: Iterable[str] = (),
+        keep: bool = False,
+        **kwargs,
+    ) -> Iterator[tuple]:
+        """Yields ``(row, doc)`` for the ``rows`` (all if not given) of column ``col``, in this order.
+
+        Stored docs are used if they were parsed by the same ``nlp`` with at most the components ``disable``
+        disabled, the others are parsed now as they are needed (the kwargs go to ``nlp.pipe``).
+        Only if ``keep`` the newly parsed docs are stored for later stages, otherwise they can be freed as soon
+        as the caller is done with them.
+        """
+        rows = range(len(self._chunk)) if rows is None else list(rows)
+        disable = frozenset(disable)
+        stored_nlp, stored_disable, stored = self._docs.get(col, (None, None, None))
+        if stored_nlp is not nlp or not stored_disable <= disable:
+            stored = None
+        if keep and stored is None:
+            stored = [None] * len(self._chunk)
+            self._docs[col] = (nlp, disable, stored)
+        missing = [i for i in rows if stored is None or stored[i] is None]
+        if missing and col not in self._texts:
+            self._texts[col] = self._chunk[col].fillna(" ").astype(str).values
+        texts = self._texts.get(col)
+        parsed = zip(missing, nlp.pipe((texts[i] for i in missing), disable=list(disable), **kwargs))
+        for i in rows:
+            if stored is not None and stored[i] is not None:
+                yield i, stored[i]
+                continue
+            _, doc = next(parsed)
+            if keep:
+                stored[i] = doc
+            yield i, doc
+
+    def put_sentences(self, col: str, spans: List):
+        """Stores the character offsets ``[(start, end), ...]`` of the sentences per row of column ``col``."""
+        self._sentences[col] = spans
+
+    def sentences(self, col: str) -> Optional[List]:
+        """The sentence offsets per row of column ``col``, if a stage found them."""
+        return self._sentences.get(col)
+
+
 class PipelineStage(object):
+    """Base class of the stages of a :class:`Pipeline`.
+
+    A stage implements :meth:`new_columns` returning only the columns it adds to a chunk;
+    the pipeline adds them to the chunk without copying it.
+    """
+
     def __init__(self, name=None):
         self.name = type(self).__name__ if name is None else name
 
     def adding_to_pipeline(self, pipeline):
         self._pipeline = pipeline
 
+    def __getstate__(self):
+        # The pipeline (and its ElasticStack) stays in the parent process when stages are sent to workers.
+        state = self.__dict__.copy()
+        state.pop("_pipeline", None)
+        return state
+
     def doprocess(self, x):
         raise NotImplementedError()
 
+    def new_columns(self, text: pd.DataFrame) -> Mapping[str, Union[pd.Series, np.ndarray, list]]:
+        """The columns this stage adds to ``text`` (Series are aligned on its index, anything else by position)."""
+        raise NotImplementedError()
+
+    def process(self, text: pd.DataFrame) -> pd.DataFrame:
+        """Returns ``text`` with the new columns of this stage, the existing columns are not copied."""
+        return _append_columns(text.copy(deep=False), self.new_columns(text))
+
     def tic(self, name):
         self._pipeline.tic(self.name, name)
 
     def ticwrap(self, iter, name):
         return self._pipeline._tictoc.wrap(iter, f"{self.name} / {name}")
 
+    def count(self, name, n=1):
+        self._pipeline._tictoc.count(f"{self.name} / {name}", n)
+
+    def close(self):
+        """Called at the end of :meth:`Pipeline.process`, e.g. to shut down worker pools."""
+        pass
+
+    def needs_docs(self, col: str) -> bool:
+        """Whether the stage uses the spaCy docs of column ``col`` from :attr:`Pipeline.docs`.
+
+        Earlier stages keep their docs in the store only if a later stage needs them.
+        """
+        return False
+
     def toc(self):
         self._pipeline.toc()
 
@@ -334,12 +1005,10 @@ class MapToSingle(PipelineStage):
         self._col = col if isinstance(col, str) else col[0]
         self._outCol = out_col
 
-    def process(self, text):
+    def new_columns(self, text):
         # print(self._col, type(text[self._col]))
         target = text[self._col].apply(lambda x: self.doprocess(str(x)))
-        text = text.copy()
-        text.loc[:, self._outCol] = target
-        return text
+        return {self._outCol: target}
 
 
 class MapToTags(PipelineStage):
@@ -352,16 +1021,17 @@ class MapToTags(PipelineStage):
         super(MapToTags, self).adding_to_pipeline(pipeline)
         pipeline._tagCols.append(self._outCol)
 
-    def process(self, text):
-        target = []
-        for i in range(len(text)):
-            vals = []
-            for c in self._cols:
-                vals += self.doprocess(text[c].iloc[i])
-            target.append(vals)
-        text = text.copy()
-        text.loc[:, self._outCol] = pd.Series(target)
-        return text
+    def new_columns(self, text):
+        target = None
+        for c in self._cols:
+            vals = self.doprocess_column(text[c])
+            # elementwise concatenation of the lists, aligned on the index
+            target = vals if target is None else target + vals
+        return {self._outCol: target}
+
+    def doprocess_column(self, col: pd.Series) -> pd.Series:
+        """The lists of tags for a whole column. Override this for a faster version than calling doprocess per row."""
+        return col.map(self.doprocess)
 
 
 class RegexTag(MapToTags):
@@ -379,27 +1049,278 @@ class RegexTag(MapToTags):
         y = self._regex.findall(x)
         return y
 
+    def doprocess_column(self, col):
+        try:
+            y = col.str.findall(self._regex)
+        except AttributeError:
+            # no string values at all in this chunk (e.g. a column that is all missing), hence no tags
+            return pd.Series([[] for _ in range(len(col))], index=col.index, dtype=object)
+        missing = y.isna()
+        if missing.any():
+            # non-string values have no tags
+            y = y.copy()
+            y[missing] = pd.Series([[] for _ in range(missing.sum())], index=y.index[missing])
+        return y
+
+
+class MultiRegexTag(PipelineStage):
+    """
+    Stage that extracts several kinds of tags based on Regular Expressions, scanning each text only once.
+
+    The patterns are combined into one alternation. Hence, like within one regular expression, the leftmost match
+    wins, at the same position the pattern given first wins, and matches of different patterns do not overlap.
+    Patterns that cannot be combined (e.g. with backreferences, conditional groups, or inline flags) are matched
+    separately.
+    The tags of a pattern are what ``re.findall`` would return.
+
+    >>> MultiRegexTag({'doi': r'doi:[^ ]+', 'ticket': r'#(\\d+)'}, ['message'])
+
+    Parameters
+    ----------
+    patterns :
+        Mapping of the output tag column to its regular expression.
+    cols :
+        The text columns to scan.
+    flags :
+        Flags for all patterns, e.g. ``re.IGNORECASE``.
+    """
+
+    def __init__(self, patterns: Mapping[str, str], cols: Union[str, List[str]], flags: int = 0):
+        super(MultiRegexTag, self).__init__()
+        import re
+
+        self._cols = [cols] if isinstance(cols, str) else cols
+        self._outCols = list(patterns)
+        self._separate = {}
+        self._groups = {}
+        combined = []
+        group = 1
+        for out_col, pattern in patterns.items():
+            alternative = f"(?P<_tag{len(self._groups)}>{pattern})"
+            try:
+                if re.search(r"\\[1-9]|\(\?P=|\(\?\(", pattern):
+                    raise re.error("backreferences and conditional groups need the original group numbers")
+                re.compile("|".join(combined + [alternative]), flags)
+            except re.error:
+                self._separate[out_col] = re.compile(pattern, flags)
+                continue
+            n_groups = re.compile(pattern, flags).groups
+            self._groups[group] = (out_col, n_groups)
+            combined.append(alternative)
+            group += 1 + n_groups
+        self._regex = re.compile("|".join(combined), flags) if combined else None
+
+    def adding_to_pipeline(self, pipeline):
+        super(MultiRegexTag, self).adding_to_pipeline(pipeline)
+        pipeline._tagCols.extend(self._outCols)
+
+    def _tag(self, match):
+        group = match.lastindex
+        out_col, n_groups = self._groups[group]
+        if n_groups == 0:
+            return out_col, match.group(group)
+        inner = tuple(_ or "" for _ in match.groups()[group : group + n_groups])  # noqa: E203
+        return out_col, inner[0] if n_groups == 1 else inner
+
+    def doprocess(self, x):
+        """The dict of tag lists of one text."""
+        tags = {out_col: [] for out_col in self._outCols}
+        if not isinstance(x, str):
+            return tags
+        if self._regex is not None:
+            for match in self._regex.finditer(x):
+                out_col, tag = self._tag(match)
+                tags[out_col].append(tag)
+        for out_col, regex in self._separate.items():
+            tags[out_col] = regex.findall(x)
+        return tags
+
+    def new_columns(self, text):
+        targets = {out_col: [[] for _ in range(len(text))] for out_col in self._outCols}
+        for c in self._cols:
+            for i, x in enumerate(text[c].values):
+                for out_col, tags in self.doprocess(x).items():
+                    targets[out_col][i] += tags
+        return targets
+
 
 class VaderSentiment(MapToSingle):
     """
     This is a simple Stage that adds a column recording the sentiment of a text.
     It uses the Vader library, which gives a rule based sentiment for english texts.
+
+    Identical texts within a batch are scored once and scores are memoized across batches.
+
+    Parameters
+    ----------
+    col :
+        The text column.
+    out_col :
+        The column for the compound score.
+    scores :
+        Which of Vader's ``'neg'``, ``'neu'``, ``'pos'``, ``'compound'`` scores to produce, ``True`` for all.
+        The compound score is written to ``out_col``, the others to ``{out_col}_{score}``.
+    cache_size :
+        Number of texts whose scores are memoized (least recently used are dropped), ``0`` to disable.
+        The memo is keyed by a 16 byte digest of the text, so it does not keep the texts in memory.
+    n_process :
+        If bigger than ``1`` the texts of a batch are scored in a pool of this many processes.
+        The pool lives until the end of :meth:`Pipeline.process`.
+        It is ignored in the workers of :meth:`Pipeline.process` with ``n_workers``.
+    granularity :
+        ``'document'`` (default) scores each text as a whole.
+        ``'sentence'`` scores each sentence and writes the mean, minimum, maximum, and share of negative
+        (compound <= -0.05) compound scores to ``out_col``, ``{out_col}_min``, ``{out_col}_max``,
+        and ``{out_col}_neg_share``. Sentences are taken from an earlier :class:`SpacyEnrichment` of the same
+        column if there is one, otherwise the text is split after ``.``, ``!``, ``?`` and at empty lines.
     """
 
-    def __init__(self, *args, **kwargs):
+    SCORES = ["neg", "neu", "pos", "compound"]
+    AGGREGATES = ["mean", "min", "max", "neg_share"]
+    _SENTENCE_END = re.compile(r"(?<=[.!?])\s+|\n\s*\n")
+
+    def __init__(
+        self,
+        *args,
+        scores: Union[bool, str, List[str]] = "compound",
+        cache_size: int = 100000,
+        n_process: int = 1,
+        granularity: str = "document",
+        **kwargs,
+    ):
         super(VaderSentiment, self).__init__(*args, **kwargs)
         from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
 
         self._analyzer = SentimentIntensityAnalyzer()
+        scores = self.SCORES if scores is True else [scores] if isinstance(scores, str) else scores
+        assert all(_ in self.SCORES for _ in scores), f"scores have to be some of {self.SCORES}"
+        assert granularity in ("document", "sentence"), "granularity has to be 'document' or 'sentence'"
+        self._granularity = granularity
+        self._scores = scores
+        self._vader_scores = scores if granularity == "document" else ["compound"]
+        self._cache_size = cache_size
+        self._memo = OrderedDict()
+        self._n_process = n_process
+        self._pool = None
+
+    def _score_col(self, score):
+        return self._outCol if score == "compound" else f"{self._outCol}_{score}"
+
+    def _aggregate_col(self, aggregate):
+        return self._outCol if aggregate == "mean" else f"{self._outCol}_{aggregate}"
 
     def adding_to_pipeline(self, pipeline):
         super(VaderSentiment, self).adding_to_pipeline(pipeline)
-        pipeline._numCols.append(self._outCol)
+        if self._granularity == "document":
+            pipeline._numCols.extend(self._score_col(_) for _ in self._scores)
+        else:
+            pipeline._numCols.extend(self._aggregate_col(_) for _ in self.AGGREGATES)
+
+    def __getstate__(self):
+        state = super(VaderSentiment, self).__getstate__()
+        state["_pool"] = None
+        state["_memo"] = OrderedDict()
+        return state
 
     def doprocess(self, x):
         y = self._analyzer.polarity_scores(x)["compound"]
         return y
 
+    def new_columns(self, text):
+        texts = text[self._col].map(str)
+        codes, uniques = pd.factorize(texts)
+        if self._granularity == "document":
+            scores = self._score_texts(list(uniques))
+            return {
+                self._score_col(score): pd.Series(scores[codes, j], index=text.index)
+                for j, score in enumerate(self._scores)
+            }
+
+        # sentence granularity: split each distinct text once, score all sentences together
+        boundaries = self._pipeline.docs.sentences(self._col)
+        first = np.unique(codes, return_index=True)[1]
+        sentences, owner = [], []
+        for i, u in enumerate(uniques):
+            sents = self._split(u, None if boundaries is None else boundaries[first[i]])
+            sentences.extend(sents)
+            owner.extend([i] * len(sents))
+        compound = self._score_texts(sentences)[:, 0]
+        owner = np.array(owner, dtype=np.intp)
+        n = np.bincount(owner, minlength=len(uniques))
+        mean = np.bincount(owner, weights=compound, minlength=len(uniques)) / np.maximum(n, 1)
+        neg_share = np.bincount(owner, weights=compound <= -0.05, minlength=len(uniques)) / np.maximum(n, 1)
+        lo, hi = np.full(len(uniques), np.inf), np.full(len(uniques), -np.inf)
+        np.minimum.at(lo, owner, compound)
+        np.maximum.at(hi, owner, compound)
+        aggregates = {"mean": mean, "min": lo, "max": hi, "neg_share": neg_share}
+        return {
+            self._aggregate_col(k): pd.Series(v[codes], index=text.index) for k, v in aggregates.items()
+        }
+
+    def _split(self, text, boundaries=None):
+        """The sentences of a text, from the character offsets of a spaCy stage if they fit the text."""
+        if boundaries and boundaries[-1][1] <= len(text):
+            sents = [text[start:end] for start, end in boundaries]
+        else:
+            sents = [_ for _ in self._SENTENCE_END.split(text) if _.strip()]
+        return sents or [text]
+
+    def _score_texts(self, texts):
+        """The Vader scores of the texts as array (one row per text), memoized and possibly in parallel."""
+        scores = np.empty((len(texts), len(self._vader_scores)), dtype=float)
+        keys = [hashlib.blake2b(t.encode("utf-8", "surrogatepass"), digest_size=16).digest() for t in texts]
+        missing = []
+        for i, key in enumerate(keys):
+            if key in self._memo:
+                self._memo.move_to_end(key)
+                scores[i] = self._memo[key]
+            else:
+                missing.append(i)
+        self.count("memo hits", len(texts) - len(missing))
+        if missing:
+            todo = [texts[i] for i in missing]
+            if self._n_process > 1:
+                if self._pool is None:
+                    from concurrent.futures import ProcessPoolExecutor
+                    import multiprocessing
+
+                    self._pool = ProcessPoolExecutor(
+                        max_workers=self._n_process, mp_context=multiprocessing.get_context("spawn")
+                    )
+                chunksize = max(1, len(todo) // (4 * self._n_process))
+                new = list(
+                    self._pool.map(_vader_scores, todo, itertools.repeat(self._vader_scores), chunksize=chunksize)
+                )
+            else:
+                new = [_vader_scores(t, self._vader_scores, self._analyzer) for t in todo]
+            for i, row in zip(missing, new):
+                scores[i] = row
+                if self._cache_size > 0:
+                    self._memo[keys[i]] = row
+            while len(self._memo) > self._cache_size:
+                self._memo.popitem(last=False)
+        return scores
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+
+_VADER_ANALYZER = None
+
+
+def _vader_scores(text, scores, analyzer=None):
+    global _VADER_ANALYZER
+    if analyzer is None:
+        if _VADER_ANALYZER is None:
+            from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+
+            _VADER_ANALYZER = SentimentIntensityAnalyzer()
+        analyzer = _VADER_ANALYZER
+    polarity = analyzer.polarity_scores(text)
+    return tuple(polarity[_] for _ in scores)
+
 
 # pipeline = Pipeline(index='nips', textCols=['message','title'])
 # pipeline.add(RegexTag(r'\$([^$]+)\$', ['message'], 'math'))
@@ -438,8 +1359,8 @@ class MapToNamedTags(PipelineStage):
         pipeline._tagCols.extend(self._outCols)
         pipeline._ignoreUploadCols.extend(self._ignoreUploadCols)
 
-    def process(self, text):
-        target = [text]
+    def new_columns(self, text):
+        target = {}
         for c in self._cols:
             x = text[c]
             if self._coerceValsToStr:
@@ -448,12 +1369,156 @@ class MapToNamedTags(PipelineStage):
                 # it is on the end of the pipeleine... however ' ' seems to be ok.
                 x = x.fillna(" ").astype(str)
             y = self.doprocess(x)
-            y = pd.DataFrame(y, index=text.index).rename(
-                mapper=lambda x: c + "_" + x, axis=1
-            )
-            target.append(y)
-        text = pd.concat(target, axis=1, sort=False)
-        return text
+            if not isinstance(y, dict):
+                # a list of dicts per row
+                y = pd.DataFrame(y, index=text.index)
+            for k, v in y.items():
+                target[c + "_" + k] = v
+        return target
+
+
+class _ColumnBuilder(object):
+    """Collects the values of ``n`` rows into preallocated typed columns.
+
+    The kind of a column is decided by its first value: integers go into an ``int32`` array (missing are 0),
+    1-d numpy arrays into one 2-d ``float32`` array (missing are 0), everything else (e.g. lists of tags) into
+    an object array (missing are ``None``).
+    """
+
+    def __init__(self, n):
+        self._n = n
+        self._counts = {}
+        self._vectors = {}
+        self._objects = {}
+
+    def set(self, i, row):
+        for k, v in row.items():
+            if k in self._counts:
+                self._counts[k][i] = v
+            elif k in self._vectors:
+                self._vectors[k][i] = v
+            elif k in self._objects:
+                self._objects[k][i] = v
+            elif isinstance(v, (numbers.Integral, np.integer)):
+                self._counts[k] = np.zeros(self._n, dtype=np.int32)
+                self._counts[k][i] = v
+            elif isinstance(v, np.ndarray) and v.ndim == 1:
+                self._vectors[k] = np.zeros((self._n, len(v)), dtype=np.float32)
+                self._vectors[k][i] = v
+            else:
+                self._objects[k] = np.full(self._n, None, dtype=object)
+                self._objects[k][i] = v
+
+    def columns(self):
+        """The columns as a dict of arrays, vectors become an object array of views on the rows of the 2-d array."""
+        result = dict(self._counts)
+        for k, matrix in self._vectors.items():
+            rows = np.empty(self._n, dtype=object)
+            for i in range(self._n):
+                rows[i] = matrix[i]
+            result[k] = rows
+        result.update(self._objects)
+        return result
+
+
+_WINDOW_BREAKS = [re.compile(r"\n\s*\n"), re.compile(r"(?<=[.!?])\s+"), re.compile(r"\s+")]
+
+
+def _text_windows(text, size, overlap):
+    """Splits a long text into windows ``(start, end, own_start, own_end)``.
+
+    The owned parts ``own_start:own_end`` cover the text without overlap and are at most ``size`` characters,
+    cut at the last paragraph break, else sentence end, else whitespace. The windows ``start:end`` add up to
+    ``overlap`` characters of context on both sides, cut at whitespace.
+    """
+    cuts = [0]
+    while len(text) - cuts[-1] > size:
+        start = cuts[-1]
+        lo = start + size // 2
+        cut = start + size
+        for pattern in _WINDOW_BREAKS:
+            last = None
+            for last in pattern.finditer(text, lo, start + size):
+                pass
+            if last is not None:
+                cut = last.end()
+                break
+        cuts.append(cut)
+    cuts.append(len(text))
+    windows = []
+    for own_start, own_end in zip(cuts[:-1], cuts[1:]):
+        start, end = max(0, own_start - overlap), min(len(text), own_end + overlap)
+        if start > 0:
+            space = re.compile(r"\s").search(text, start, own_start)
+            start = space.end() if space else own_start
+        if end < len(text):
+            space = None
+            for space in re.finditer(r"\s", text[own_end:end]):
+                pass
+            end = own_end + space.start() if space else own_end
+        windows.append((start, end, own_start, own_end))
+    return windows
+
+
+def _window_text(text, window):
+    return text if window is None else text[window[0] : window[1]]  # noqa: E203
+
+
+_SPACY_STAGE = None
+
+
+def _init_spacy_worker(stage):
+    global _SPACY_STAGE
+    _SPACY_STAGE = stage
+    _SPACY_STAGE._warm_up()
+
+
+def _spacy_worker_extract(tasks):
+    """Parses ``(text, window)`` tasks in a worker process and returns their enrichments (not the docs)."""
+    docs = _SPACY_STAGE._nlp.pipe(
+        (text for text, _ in tasks), disable=_SPACY_STAGE._disable, batch_size=_SPACY_STAGE._batch_size
+    )
+    return [_SPACY_STAGE._extract_task(doc, window) for doc, (_, window) in zip(docs, tasks)]
+
+
+def _merge_windows(rets):
+    """Merges the enrichments of the windows of one text.
+
+    Counts are summed up, lists concatenated, and the vectors are the average of the raw window vectors ``'_vec'``
+    weighted by the number of tokens.
+    """
+    merged, vecs, weights = {}, [], []
+    for ret in rets:
+        for k, v in ret.items():
+            if k == "_vec":
+                vecs.append(v)
+                weights.append(ret["wc"])
+            elif k not in ("vec", "vec_normalized"):
+                merged[k] = merged[k] + v if k in merged else v
+    if vecs:
+        vec = np.average(np.stack(vecs), axis=0, weights=weights).astype(np.float32)
+        if any("vec" in _ for _ in rets):
+            merged["vec"] = vec
+        if any("vec_normalized" in _ for _ in rets):
+            norm = np.linalg.norm(vec)
+            merged["vec_normalized"] = vec / norm if norm != 0 else vec
+    return merged
+
+
+# the models loaded by name, see SpacyEnrichment._load
+_SPACY_MODELS = weakref.WeakValueDictionary()
+
+
+def _model_components(name):
+    """The components (including disabled ones) of an installed or saved spaCy model, from its meta data."""
+    from pathlib import Path
+
+    try:
+        path = spacy.util.get_package_path(name) if spacy.util.is_package(name) else Path(name)
+        meta = spacy.util.get_model_meta(path)
+    except Exception:
+        return []
+    return meta.get("components", meta.get("pipeline", []))
 
 
 class SpacyEnrichment(MapToNamedTags):
@@ -479,10 +1544,50 @@ class SpacyEnrichment(MapToNamedTags):
     return_doc :
         Return the spaCy doc object per as ``{textcol_name}_doc``.
         This can be then used for further analysis.
+        Later stages of the pipeline can get the docs without keeping them in the result
+        from :attr:`Pipeline.docs`, see :class:`DocStore`.
     batch_size :
         Passed to spaCy's pipe.
     n_threads :
-        Passed to spaCy's pipe.
+        Deprecated, use ``n_process``.
+    n_process :
+        If bigger than ``1`` the texts are parsed in a pool of this many processes, that load the model once and
+        live until the end of :meth:`Pipeline.process`. The workers send back the enrichments instead of the docs,
+        so the docs are not available (``return_doc`` cannot be used, :attr:`Pipeline.docs` has none).
+        Each worker parses ``batch_size`` texts at a time.
+        It is ignored in the workers of :meth:`Pipeline.process` with ``n_workers``.
+    sort_by_length :
+        Parse the texts of a chunk sorted by length, so texts of similar length are in the same batch.
+        The results are in the original order.
+    max_batch_tokens :
+        Make batches of at most this many tokens (estimated as whitespace separated words, a longer text is
+        a batch of its own) and at most ``batch_size`` texts, instead of batches of ``batch_size`` texts.
+        This bounds the memory spaCy needs per batch for a mix of short and very long texts.
+        Implies ``sort_by_length``.
+    max_window_chars :
+        Texts longer than this are parsed in windows of about this many characters, cut preferably at paragraphs,
+        then sentences, then whitespace, and parsed together with the other texts.
+        The results of the windows are merged into one row: counts and tags are summed up, sentence and character
+        offsets refer to the whole text, and vectors are averaged weighted by the number of tokens.
+        Use this for texts longer than spaCy's ``max_length`` or that need too much memory per doc.
+        The docs of such texts are not available (``None`` with ``return_doc`` and in :attr:`Pipeline.docs`).
+    window_overlap :
+        Characters of context added on both sides of a window; only the tokens starting in the window itself count.
+    cache :
+        An :class:`~nlpeasy.cache.EnrichmentCache` or the path of its SQLite file.
+        Texts already enriched with the same model and options are taken from the cache and are not parsed again.
+        Hits and misses are counted in :meth:`~nlpeasy.Pipeline.summary`. Cannot be used with ``return_doc``.
+    select_pipes :
+        If ``True`` (default) only the components needed for ``tags``, ``pos_stats``, and sentence counts are run,
+        e.g. only ``ner`` (and ``senter``) for ``tags=['ents'], pos_stats=False``.
+        A model given by name is loaded without the other components, a given model is not changed
+        but the other components are disabled while parsing.
+        Docs from ``return_doc`` or :attr:`Pipeline.docs` only have the annotations of these components.
+        Stages loading the same model by name with the same components share it. To parse a column only once for
+        several stages with other enrichments, pass the same loaded model to all of them: the first stage then
+        runs the components the later ones need as well and keeps the docs for them.
+    warm_up :
+        Parse a few texts at construction, so the first chunk is not slowed down by lazy initializations.
     kwargs :
         Passed to super.
     """
@@ -497,7 +1602,15 @@ class SpacyEnrichment(MapToNamedTags):
         ents_exclude: List[str] = [ 'CARDINAL', 'DATE', 'MONEY', 'ORDINAL', 'PERCENT', 'QUANTITY', 'TIME', ],
         return_doc: bool = False,
         batch_size: int = 1000,
-        n_threads: int = -1,
+        n_threads: Optional[int] = None,
+        n_process: int = 1,
+        sort_by_length: bool = False,
+        max_batch_tokens: Optional[int] = None,
+        max_window_chars: Optional[int] = None,
+        window_overlap: int = 200,
+        cache: Union[None, str, EnrichmentCache] = None,
+        select_pipes: bool = True,
+        warm_up: bool = True,
         **kwargs: Mapping,
     ) -> "SpacyEnrichment":
         super(SpacyEnrichment, self).__init__(
@@ -506,63 +1619,334 @@ class SpacyEnrichment(MapToNamedTags):
             ignore_upload_cols=["doc", "vec", "vec_normalized"],
             **kwargs,
         )
-        self._nlp = spacy.load(nlp) if isinstance(nlp, str) else nlp
         self._posNum = pos_stats
         self._ents_exclude = ents_exclude
         self._batch_size = batch_size
-        self._n_threads = n_threads
+        if n_threads is not None:
+            warnings.warn("n_threads is deprecated, use n_process", DeprecationWarning)
+            n_process = os.cpu_count() if n_threads < 0 else n_threads
+        assert n_process <= 1 or not return_doc, "return_doc=True cannot be used with n_process > 1"
+        self._n_process = n_process
+        self._pool = None
+        self._sort_by_length = sort_by_length
+        self._max_batch_tokens = max_batch_tokens
+        self._max_window_chars = max_window_chars
+        self._window_overlap = window_overlap
         self._returnDoc = return_doc
         self._vec = vec
+        self._select_pipes = select_pipes
+        self._nlp_name = nlp if isinstance(nlp, str) else None
+        self._disable = []
+        if isinstance(nlp, str):
+            self._nlp = self._load(nlp)
+        else:
+            self._nlp = nlp
+            if select_pipes:
+                # a given model is not changed, the components are disabled when parsing
+                unneeded = self._unneeded_pipes(nlp.pipe_names)
+                self._disable = [_ for _ in nlp.pipe_names if _ in unneeded]
+        assert cache is None or not return_doc, "return_doc=True cannot be used with a cache"
+        self._cache = EnrichmentCache(cache) if isinstance(cache, (str, os.PathLike)) else cache
+        self._cache_prefix = self._fingerprint()
+        if warm_up:
+            self._warm_up()
+
+    # the trained components that are only run if needed for the enrichments, any other is kept
+    _OPTIONAL_PIPES = ("ner", "parser", "senter", "tagger", "morphologizer", "attribute_ruler", "lemmatizer")
+
+    def _unneeded_pipes(self, components):
+        """The optional components of a model with ``components`` that are not needed for the enrichments."""
+        needed = set()
+        if "ents" in self._tags:
+            needed.add("ner")
+        if "subj" in self._tags:
+            needed.update(["parser", "lemmatizer"])
+        if "verb" in self._tags:
+            needed.add("lemmatizer")
+        if "verb" in self._tags or self._posNum or "lemmatizer" in needed:
+            needed.update(["tagger", "morphologizer", "attribute_ruler"])
+        if "parser" not in needed and "sentencizer" not in components:
+            # sentence_count needs sentence boundaries, the senter is much faster than the parser
+            needed.add("senter" if "senter" in components else "parser")
+        return [_ for _ in self._OPTIONAL_PIPES if _ in components and _ not in needed]
+
+    def _load(self, name):
+        exclude = tuple(self._unneeded_pipes(_model_components(name))) if self._select_pipes else None
+        # stages loading the same model with the same components share it, so they can share the docs
+        nlp = _SPACY_MODELS.get((name, exclude))
+        if nlp is not None:
+            return nlp
+        if exclude is None:
+            nlp = spacy.load(name)
+        else:
+            nlp = spacy.load(name, exclude=list(exclude))
+            if "senter" in nlp.disabled:
+                # the senter is disabled by default in the trained pipelines
+                nlp.enable_pipe("senter")
+        _SPACY_MODELS[(name, exclude)] = nlp
+        return nlp
+
+    def _warm_up(self):
+        """Parses a few texts, so that lazy initializations do not count to the first chunk."""
+        for _ in self._nlp.pipe(["Warm up.", "This is a warm up text with New York."], disable=self._disable):
+            pass
+
+    def _fingerprint(self):
+        """Identifies model and options, enrichments are only taken from the cache if these match."""
+        meta = self._nlp.meta
+        return repr(
+            (
+                meta.get("lang"),
+                meta.get("name"),
+                meta.get("version"),
+                [_ for _ in self._nlp.pipe_names if _ not in self._disable],
+                sorted(self._tags),
+                self._posNum if isinstance(self._posNum, bool) else sorted(self._posNum),
+                self._vec,
+                sorted(self._ents_exclude),
+                self._max_window_chars,
+                self._window_overlap if self._max_window_chars else None,
+            )
+        )
+
+    def __getstate__(self):
+        # A model loaded by name is loaded again in the worker instead of being serialized.
+        state = super(SpacyEnrichment, self).__getstate__()
+        if self._nlp_name is not None:
+            state["_nlp"] = None
+        state["_pool"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self._nlp is None:
+            self._nlp = self._load(self._nlp_name)
 
     def doprocess(self, x):
-        docs = []
-        self.tic("spacy make iter")
-        spacy_iter = self._nlp.pipe(
-            x.values, batch_size=self._batch_size, n_process=self._n_threads
-        )
-        self.toc()
-        for doc in self.ticwrap(spacy_iter, "spacy iter"):
-            self.tic("process spacy docs")
-            ret = {"wc": len(doc), "sentence_count": len(list(doc.sents))}
-            if ret["wc"] == 0:
-                docs.append(ret)
-                continue
-            if "ents" in self._tags:
-                #             ents = pd.DataFrame({ 'ent': e.text, 'lab': e.label_} for e in doc.ents )
-                for e in doc.ents:
-                    ret["entity_" + e.label_] = ret.get("entity_" + e.label_, []) + [
-                        e.text
-                    ]
-                    if e.label_ not in self._ents_exclude:
-                        ret["ents"] = ret.get("ents", []) + [e.text]
-
-            tok = pd.DataFrame(
-                {"text": w.text, "lemma": w.lemma_, "pos": w.pos_, "dep": w.dep_}
-                for w in doc
-            )
-            if "subj" in self._tags:
-                ret["subj"] = list(tok.lemma.loc[tok.dep.isin(["nsubj", "sb"])])
-            if "verb" in self._tags:
-                ret["verb"] = list(tok.lemma.loc[tok.pos == "VERB"])
-
-            pos_num = tok.pos.value_counts()
-            pos_sel = tok.pos.unique() if self._posNum is True else self._posNum
-            for pos in pos_sel:
-                ret["num_" + pos] = pos_num.loc[pos]
-            if self._vec:
-                if self._vec is True or self._vec == "unnormalized":
-                    ret["vec"] = doc.vector
-                if self._vec is True or self._vec == "normalized":
-                    ret["vec_normalized"] = (
-                        doc.vector / doc.vector_norm
-                        if doc.vector_norm != 0
-                        else doc.vector
-                    )
+        columns = _ColumnBuilder(len(x))
+        sentences = [None] * len(x)
+        texts = x.values
+        todo = [[i] for i in range(len(texts))]
+        keys, new = None, {}
+        if self._cache is not None:
+            self.tic("cache lookup")
+            keys = [EnrichmentCache.key(text, self._cache_prefix) for text in texts]
+            cached = self._cache.get_many(keys)
+            positions = {}
+            for i, k in enumerate(keys):
+                if k in cached:
+                    ret = dict(cached[k])
+                    sentences[i] = ret.pop("_sents", None)
+                    columns.set(i, ret)
+                else:
+                    positions.setdefault(k, []).append(i)
+            todo = list(positions.values())
+            self.count("cache hits", len(texts) - sum(len(_) for _ in todo))
+            self.count("cache misses", sum(len(_) for _ in todo))
+            self.toc()
+        rows = [_[0] for _ in todo]
+        windows = []
+        if self._max_window_chars:
+            long = [i for i in rows if len(texts[i]) > self._max_window_chars]
+            windows = [
+                (i, w) for i in long for w in _text_windows(texts[i], self._max_window_chars, self._window_overlap)
+            ]
+            self.count("windows", len(windows))
+            rows = [i for i in rows if len(texts[i]) <= self._max_window_chars]
+        groups = {same[0]: same for same in todo}
+
+        def emit(i, ret, doc=None):
+            # the enrichments of row i go to all rows with the same text and to the cache
+            if keys is not None:
+                new[keys[i]] = ret
+            ret = dict(ret)
+            sents = ret.pop("_sents")
             if self._returnDoc:
                 ret["doc"] = doc
-            docs.append(ret)
+            for j in groups[i]:
+                sentences[j] = sents
+                columns.set(j, ret)
+
+        parts = {}
+        if self._n_process > 1:
+            self.tic("spacy parse in pool")
+            # at most batch_size texts per task, but enough tasks for all workers
+            size = max(1, min(self._batch_size, -(-(len(rows) + len(windows)) // self._n_process)))
+            tasks = [
+                [(i, None) for i in batch[k : k + size]]  # noqa: E203
+                for batch, _ in self._batches(texts, rows)
+                for k in range(0, len(batch), size)
+            ]
+            tasks += [windows[k : k + size] for k in range(0, len(windows), size)]  # noqa: E203
+            rets = self._get_pool().map(
+                _spacy_worker_extract, [[(_window_text(texts[i], w), w) for i, w in _] for _ in tasks]
+            )
+            for task, task_rets in zip(tasks, rets):
+                for (i, w), ret in zip(task, task_rets):
+                    if w is None:
+                        emit(i, ret)
+                    else:
+                        parts.setdefault(i, []).append(ret)
+            self.toc()
+        else:
+            if windows:
+                self.tic("spacy parse windows")
+                spacy_iter = self._nlp.pipe(
+                    (_window_text(texts[i], w) for i, w in windows), disable=self._disable, batch_size=self._batch_size
+                )
+                for (i, w), doc in zip(windows, spacy_iter):
+                    parts.setdefault(i, []).append(self._extract_task(doc, w))
+                self.toc()
+            # Docs parsed by an earlier stage with the same model are reused. The docs are extracted as they come
+            # out of spaCy and only kept if a later stage needs them.
+            later = [
+                p
+                for p in self._later_stages()
+                if p.needs_docs(x.name) and not (isinstance(p, SpacyEnrichment) and p._nlp is not self._nlp)
+            ]
+            disable = set(self._disable)
+            for p in later:
+                if isinstance(p, SpacyEnrichment) and p._nlp is self._nlp:
+                    # parse once with the components that the later stages need, too
+                    disable &= set(p._disable)
+            for batch, batch_size in self._batches(texts, rows):
+                parsed = self._pipeline.docs.parse(
+                    x.name, self._nlp, rows=batch, disable=disable, keep=bool(later), batch_size=batch_size
+                )
+                for i, doc in self.ticwrap(parsed, "spacy parse"):
+                    self.tic("process spacy docs")
+                    emit(i, self._extract(doc), doc)
+                    self.toc()
+        for i, rets in parts.items():
+            emit(i, _merge_windows(rets))
+        if new:
+            self.tic("cache store")
+            self._cache.put_many(new)
             self.toc()
-        return docs
+        # Later stages of this chunk (e.g. sentence level VaderSentiment) reuse the sentence boundaries
+        self._pipeline.docs.put_sentences(x.name, sentences)
+        self.tic("build columns")
+        columns = columns.columns()
+        self.toc()
+        return columns
+
+    def needs_docs(self, col):
+        # docs parsed in worker processes are not in the store
+        return self._n_process <= 1 and col in self._cols
+
+    def _later_stages(self):
+        pipeline = getattr(self, "_pipeline", None)
+        stages = pipeline._pipeline if pipeline is not None else []
+        return stages[stages.index(self) + 1 :] if self in stages else []  # noqa: E203
+
+    def _batches(self, texts, rows):
+        """The rows to parse as ``(rows, batch_size)`` pairs, the docs are put back in the original order."""
+        if not (self._sort_by_length or self._max_batch_tokens):
+            return [(rows, self._batch_size)]
+        rows = sorted(rows, key=lambda i: len(texts[i]))
+        if not self._max_batch_tokens:
+            return [(rows, self._batch_size)]
+        batches, batch, tokens = [], [], 0
+        for i in rows:
+            n = len(texts[i].split())
+            if batch and (tokens + n > self._max_batch_tokens or len(batch) >= self._batch_size):
+                batches.append((batch, len(batch)))
+                batch, tokens = [], 0
+            batch.append(i)
+            tokens += n
+        if batch:
+            batches.append((batch, len(batch)))
+        return batches
+
+    def _extract_task(self, doc, window=None):
+        """The enrichments of a doc of a whole text or of a ``window`` from :func:`_text_windows`."""
+        if window is None:
+            return self._extract(doc)
+        start, _, own_start, own_end = window
+        # a window only contributes the tokens starting in the part of the text it owns
+        idx = doc.to_array(IDX).astype(np.int64) + start
+        lo, hi = (int(_) for _ in np.searchsorted(idx, [own_start, own_end]))
+        ret = self._extract(doc, lo, hi, start)
+        if self._vec and hi > lo:
+            ret["_vec"] = doc[lo:hi].vector
+        return ret
+
+    def _get_pool(self):
+        if self._pool is None:
+            from concurrent.futures import ProcessPoolExecutor
+            import multiprocessing
+
+            # the workers load the model once and live until the end of Pipeline.process
+            self._pool = ProcessPoolExecutor(
+                max_workers=self._n_process,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_spacy_worker,
+                initargs=(self,),
+            )
+        return self._pool
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def _extract(self, doc, lo=0, hi=None, offset=0):
+        """The enrichments of one doc, read in bulk from the token attribute arrays.
+
+        Only the tokens ``lo`` to ``hi`` are used and ``offset`` is added to the character offsets,
+        if the doc is a window of a longer text.
+        ``'_sents'`` are the character offsets of the sentences, they are not a column.
+        """
+        hi = len(doc) if hi is None else hi
+        part = lo > 0 or hi < len(doc)
+        sents = [(s.start_char + offset, s.end_char + offset) for s in doc.sents if lo <= s.start < hi]
+        ret = {"wc": hi - lo, "sentence_count": len(sents), "_sents": sents}
+        if ret["wc"] == 0:
+            return ret
+        if "ents" in self._tags:
+            ents = []
+            for e in doc.ents:
+                if part and not lo <= e.start < hi:
+                    continue
+                key = "entity_" + e.label_
+                if key not in ret:
+                    ret[key] = []
+                ret[key].append(e.text)
+                if e.label_ not in self._ents_exclude:
+                    ents.append(e.text)
+            if ents:
+                ret["ents"] = ents
+
+        strings = doc.vocab.strings
+        attrs = doc.to_array([POS, DEP, LEMMA])
+        if part:
+            attrs = attrs[lo:hi]
+        pos = attrs[:, 0].astype(np.intp)
+        if "subj" in self._tags:
+            subj_deps = np.array([strings["nsubj"], strings["sb"]], dtype=attrs.dtype)
+            ret["subj"] = [strings[int(i)] for i in attrs[np.isin(attrs[:, 1], subj_deps), 2]]
+        if "verb" in self._tags:
+            ret["verb"] = [strings[int(i)] for i in attrs[pos == VERB, 2]]
+
+        pos_num = np.bincount(pos)
+        if self._posNum is True:
+            for i in np.flatnonzero(pos_num):
+                ret["num_" + POS_NAMES[i]] = pos_num[i]
+        elif self._posNum:
+            for name in self._posNum:
+                i = int(POS_IDS.get(name, 0))
+                ret["num_" + name] = pos_num[i] if 0 < i < len(pos_num) else 0
+        if self._vec:
+            vec = doc[lo:hi] if part else doc
+            if self._vec is True or self._vec == "unnormalized":
+                ret["vec"] = vec.vector
+            if self._vec is True or self._vec == "normalized":
+                ret["vec_normalized"] = (
+                    vec.vector / vec.vector_norm
+                    if vec.vector_norm != 0
+                    else vec.vector
+                )
+        return ret
 
 
 def nlp_disp(doc, jupyter=True):
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+
+"""Result sinks: where :meth:`~nlpeasy.Pipeline.process` puts the enriched batches."""
+
+import os
+
+import pandas as pd
+
+from typing import Optional, List, Union
+
+from .checkpoint import Checkpoint
+
+
+class ResultSink(object):
+    """Receives the enriched batches of :meth:`~nlpeasy.Pipeline.process` one after the other.
+
+    Subclasses implement :meth:`write` and :meth:`close`, whose return value is returned by ``process``.
+    If the processing fails :meth:`abort` is called instead of :meth:`close`.
+    """
+
+    def write(self, chunk: pd.DataFrame):
+        raise NotImplementedError()
+
+    def close(self):
+        raise NotImplementedError()
+
+    def abort(self):
+        pass
+
+    def use_checkpoint(self, directory: str) -> bool:
+        """Whether the sink keeps the batches of a run with ``checkpoint_dir`` in ``directory``.
+
+        Then :meth:`write` also gets the number of the batch, so a resumed run only adds the missing batches
+        and the result has all of them. Otherwise the result of a resumed run only has the new batches.
+        """
+        return False
+
+
+class FrameSink(ResultSink):
+    """Collects all batches and returns them as one dataframe (this needs the whole result in RAM twice)."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, chunk):
+        self._chunks.append(chunk)
+
+    def close(self) -> pd.DataFrame:
+        if not self._chunks:
+            return pd.DataFrame()
+        result = pd.concat(self._chunks, sort=False)
+        self._chunks = []
+        return result
+
+    def abort(self):
+        self._chunks = []
+
+
+class _ArrowFileSink(ResultSink):
+    def __init__(self, path: Union[str, os.PathLike], exclude: Optional[List[str]] = None):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise Exception(f"Please install pyarrow for {type(self).__name__} to work: pip install pyarrow")
+        self._path = str(path)
+        self._exclude = exclude or []
+        # the files of the parts with their schemas, the first one is the file itself
+        self._parts = []
+        self._schemas = []
+        self._writer = None
+        # the directory of the numbered parts of a run with a checkpoint
+        self._part_dir = None
+
+    def _open_writer(self, path, schema):
+        raise NotImplementedError()
+
+    def _read_batches(self, path):
+        raise NotImplementedError()
+
+    def _read_schema(self, path):
+        raise NotImplementedError()
+
+    def use_checkpoint(self, directory):
+        self._part_dir = str(directory)
+        return True
+
+    def _numbered_part(self, number):
+        return os.path.join(self._part_dir, f"results-{number:08d}.part")
+
+    def write(self, chunk, number: Optional[int] = None):
+        import pyarrow as pa
+
+        table = pa.Table.from_pandas(chunk.drop(columns=self._exclude, errors="ignore"), preserve_index=True)
+        if number is not None and self._part_dir is not None:
+            # A batch of a checkpointed run is a file of its own, written completely before the batch is done.
+            # If it is processed again after a restart it replaces its file.
+            part = self._numbered_part(number)
+            writer = self._open_writer(part + ".tmp", table.schema)
+            writer.write_table(table)
+            writer.close()
+            os.replace(part + ".tmp", part)
+            return
+        if not self._schemas or not table.schema.equals(self._schemas[-1]):
+            # A batch with other columns or types (e.g. a tag column that was empty so far) starts a new part
+            if self._writer is not None:
+                self._writer.close()
+            part = self._path if not self._parts else f"{self._path}.part{len(self._parts)}"
+            self._writer = self._open_writer(part, table.schema)
+            self._parts.append(part)
+            self._schemas.append(table.schema)
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        keep = ()
+        if self._part_dir is not None:
+            self._parts = sorted(
+                os.path.join(self._part_dir, _)
+                for _ in os.listdir(self._part_dir)
+                if _.startswith("results-") and _.endswith(".part")
+            )
+            self._schemas = [self._read_schema(_) for _ in self._parts]
+            # if the checkpoint remains (e.g. some documents were not indexed) a re-run needs the parts again
+            if os.path.exists(os.path.join(self._part_dir, Checkpoint.FILE)):
+                keep = self._parts
+            if self._parts:
+                self._merge_parts(keep)
+        elif len(self._parts) > 1:
+            self._merge_parts()
+
+    def abort(self):
+        """Finishes the file with the batches so far; the numbered parts of a checkpointed run are kept."""
+        if self._part_dir is not None:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            return
+        self.close()
+
+    def _merge_parts(self, keep=()):
+        """Rewrites all parts into the file with their common schema, missing columns are null.
+
+        The parts are removed afterwards, except those in ``keep``.
+        """
+        import pyarrow as pa
+
+        schema = pa.unify_schemas(self._schemas, promote_options="permissive")
+        if self._parts[0] == self._path:
+            os.replace(self._path, f"{self._path}.part0")
+            self._parts[0] = f"{self._path}.part0"
+        writer = self._open_writer(self._path, schema)
+        try:
+            for part in self._parts:
+                for batch in self._read_batches(part):
+                    names = batch.schema.names
+                    columns = [
+                        batch.column(f.name).cast(f.type) if f.name in names else pa.nulls(len(batch), f.type)
+                        for f in schema
+                    ]
+                    writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+        finally:
+            writer.close()
+        for part in self._parts:
+            if part not in keep:
+                os.remove(part)
+        self._parts, self._schemas = [self._path], [schema]
+
+
+class ParquetSink(_ArrowFileSink):
+    """Writes the batches incrementally into a Parquet file (one row group per batch) and returns its path.
+
+    If the columns or types change between batches (e.g. a column only appears later, or a tag column is empty
+    in the first batches), the batches are written to parts that are merged at the end into one file with
+    the common schema. Missing columns are null then.
+    Columns that pyarrow cannot store (e.g. spaCy docs) have to be excluded.
+
+    Parameters
+    ----------
+    path :
+        The Parquet file to write.
+    exclude :
+        Columns not to write.
+    kwargs :
+        Passed to ``pyarrow.parquet.ParquetWriter``
+    """
+
+    def __init__(self, path: Union[str, os.PathLike], exclude: Optional[List[str]] = None, **kwargs):
+        super(ParquetSink, self).__init__(path, exclude)
+        self._kwargs = kwargs
+
+    def _open_writer(self, path, schema):
+        import pyarrow.parquet as pq
+
+        return pq.ParquetWriter(path, schema, **self._kwargs)
+
+    def _read_batches(self, path):
+        import pyarrow.parquet as pq
+
+        with pq.ParquetFile(path) as f:
+            yield from f.iter_batches()
+
+    def _read_schema(self, path):
+        import pyarrow.parquet as pq
+
+        return pq.read_schema(path)
+
+    def close(self) -> str:
+        super(ParquetSink, self).close()
+        return self._path
+
+
+class ArrowSink(_ArrowFileSink):
+    """Writes the batches incrementally into an Arrow IPC file and returns it as a memory-mapped ``pyarrow.Table``.
+
+    The returned table is not read into RAM, use ``.to_pandas()`` on (a slice of) it if needed.
+    Batches with other columns or types are merged as in :class:`ParquetSink`.
+
+    Parameters
+    ----------
+    path :
+        The Arrow file to write.
+    exclude :
+        Columns not to write.
+    """
+
+    def _open_writer(self, path, schema):
+        import pyarrow as pa
+
+        return pa.ipc.new_file(path, schema)
+
+    def _read_batches(self, path):
+        import pyarrow as pa
+
+        with pa.memory_map(path) as source:
+            reader = pa.ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                yield reader.get_batch(i)
+
+    def _read_schema(self, path):
+        import pyarrow as pa
+
+        with pa.memory_map(path) as source:
+            return pa.ipc.open_file(source).schema
+
+    def close(self):
+        import pyarrow as pa
+
+        super(ArrowSink, self).close()
+        if not self._parts:
+            return None
+        return pa.ipc.open_file(pa.memory_map(self._path)).read_all()
+
+
+def make_sink(spec: Union[bool, str, os.PathLike, ResultSink, None]) -> Optional[ResultSink]:
+    """Turns the ``return_processed`` argument of :meth:`~nlpeasy.Pipeline.process` into a result sink.
+
+    ``True`` gives a :class:`FrameSink`, ``False`` or ``None`` no sink,
+    a path ending in ``.parquet`` a :class:`ParquetSink` and in ``.arrow`` a :class:`ArrowSink`.
+    """
+    if spec is None or spec is False:
+        return None
+    if spec is True:
+        return FrameSink()
+    if isinstance(spec, ResultSink):
+        return spec
+    if isinstance(spec, (str, os.PathLike)):
+        suffix = str(spec).lower().rsplit(".", 1)[-1]
+        if suffix in ("parquet", "pq"):
+            return ParquetSink(spec)
+        if suffix in ("arrow", "feather", "ipc"):
+            return ArrowSink(spec)
+        raise Exception(f"Unknown file type for results {spec!r}: use .parquet or .arrow")
+    raise Exception(f"return_processed has to be a bool, a path, or a ResultSink, instead you used: {spec!r}")
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+"""Streaming column statistics collected batch by batch during :meth:`~nlpeasy.Pipeline.process`."""
+
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from typing import Optional, List, Iterable
+
+
+class ColumnStats(object):
+    """Statistics of one column that are updated batch by batch without retaining the data.
+
+    Numeric and date columns keep minimum, maximum and a uniform random sample of at most ``sample_size``
+    values for approximate quantiles. Tag columns (scalars or lists of tags) keep approximate top-k counts.
+
+    Parameters
+    ----------
+    kind :
+        One of ``'num'``, ``'date'``, or ``'tag'``.
+    sample_size :
+        Number of values kept for quantiles.
+    top_k :
+        Number of most frequent tags that should be reported reliably.
+        Up to ``10 * top_k`` candidates are counted.
+    seed :
+        Seed of the sampling.
+    """
+
+    def __init__(self, kind: str = "num", sample_size: int = 1024, top_k: int = 20, seed: int = 0):
+        assert kind in ("num", "date", "tag"), f"kind has to be 'num', 'date', or 'tag', not {kind!r}"
+        self.kind = kind
+        self.count = 0
+        self.nulls = 0
+        self.min = None
+        self.max = None
+        self._sample_size = sample_size
+        self._sample = np.empty(0)
+        self._sample_keys = np.empty(0)
+        self._rng = np.random.RandomState(seed)
+        self._top_k = top_k
+        self._counts = Counter()
+        self._pruned = False
+
+    @property
+    def null_rate(self) -> float:
+        return self.nulls / self.count if self.count else float("nan")
+
+    def update(self, values: pd.Series):
+        """Adds the values of one batch."""
+        self.count += len(values)
+        if self.kind == "tag":
+            self._update_tags(values)
+            return
+        notna = values.dropna()
+        self.nulls += len(values) - len(notna)
+        if len(notna) == 0:
+            return
+        lo, hi = notna.min(), notna.max()
+        self.min = lo if self.min is None else min(self.min, lo)
+        self.max = hi if self.max is None else max(self.max, hi)
+        numeric = self._as_numeric(notna)
+        if numeric is not None:
+            self._update_sample(numeric)
+
+    def _as_numeric(self, values):
+        if pd.api.types.is_datetime64_any_dtype(values):
+            return values.to_numpy(dtype="datetime64[ns]").astype("int64").astype(float)
+        if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+            return values.to_numpy(dtype=float)
+        return None
+
+    def _update_sample(self, values):
+        # Bottom-k sampling: keeping the values with the smallest random keys is a uniform sample.
+        keys = np.concatenate([self._sample_keys, self._rng.random_sample(len(values))])
+        sample = np.concatenate([self._sample, values])
+        if len(sample) > self._sample_size:
+            keep = np.argpartition(keys, self._sample_size)[: self._sample_size]
+            keys, sample = keys[keep], sample[keep]
+        self._sample_keys, self._sample = keys, sample
+
+    def _update_tags(self, values):
+        is_list = values.map(lambda v: isinstance(v, (list, tuple, np.ndarray)))
+        empty = values[is_list].map(len) == 0
+        self.nulls += int(values[~is_list].isna().sum()) + int(empty.sum())
+        tags = values.explode().dropna()
+        if len(tags) == 0:
+            return
+        self._counts.update(tags.astype(str).value_counts().to_dict())
+        capacity = 10 * self._top_k
+        if len(self._counts) > capacity:
+            self._counts = Counter(dict(self._counts.most_common(capacity)))
+            self._pruned = True
+
+    def quantile(self, q):
+        """Approximate quantile(s) ``q`` of a numeric or date column from the sample, ``None`` if unknown."""
+        if len(self._sample) == 0:
+            return None
+        result = np.quantile(self._sample, q)
+        if self.kind == "date" and isinstance(self.min, pd.Timestamp):
+            return pd.to_datetime(result)
+        return result
+
+    def top(self, k: Optional[int] = None) -> List[tuple]:
+        """The ``k`` most frequent tags with their (approximate) counts."""
+        return self._counts.most_common(k or self._top_k)
+
+    @property
+    def distinct(self) -> Optional[int]:
+        """Number of distinct tags, ``None`` if more than could be counted."""
+        return None if self._pruned else len(self._counts)
+
+    def __repr__(self):
+        if self.kind == "tag":
+            return f"ColumnStats(kind='tag', count={self.count}, nulls={self.nulls}, top={self.top(3)})"
+        return (
+            f"ColumnStats(kind={self.kind!r}, count={self.count}, nulls={self.nulls}, "
+            f"min={self.min!r}, max={self.max!r})"
+        )
+
+
+class StatsCollector(object):
+    """Keeps :class:`ColumnStats` for the numeric, date, and tag columns of a pipeline.
+
+    Columns missing in a batch are skipped, so stages may add columns later on.
+    """
+
+    def __init__(
+        self,
+        num_cols: Iterable[str] = (),
+        date_cols: Iterable[str] = (),
+        tag_cols: Iterable[str] = (),
+        **kwargs,
+    ):
+        self._columns = {}
+        for kind, cols in (("num", num_cols), ("date", date_cols), ("tag", tag_cols)):
+            for col in cols:
+                if col not in self._columns:
+                    self._columns[col] = ColumnStats(kind, **kwargs)
+
+    def update(self, df: pd.DataFrame):
+        for col, stats in self._columns.items():
+            if col in df.columns:
+                stats.update(df[col])
+
+    def __getitem__(self, col) -> ColumnStats:
+        return self._columns[col]
+
+    def __contains__(self, col):
+        return col in self._columns
+
+    def min_max(self) -> dict:
+        """The ranges of the numeric and date columns with at least one value."""
+        return {
+            col: (stats.min, stats.max)
+            for col, stats in self._columns.items()
+            if stats.kind != "tag" and stats.min is not None
+        }
+
+    def to_frame(self) -> pd.DataFrame:
+        """One row of statistics per column."""
+        rows = {}
+        for col, stats in self._columns.items():
+            row = {"kind": stats.kind, "count": stats.count, "null_rate": stats.null_rate}
+            if stats.kind == "tag":
+                row["distinct"] = stats.distinct
+                row["top"] = stats.top(5)
+            else:
+                row["min"], row["max"] = stats.min, stats.max
+                quantiles = stats.quantile([0.01, 0.5, 0.99])
+                if quantiles is not None:
+                    row["q01"], row["median"], row["q99"] = quantiles
+            rows[col] = row
+        return pd.DataFrame.from_dict(rows, orient="index")
@@ -1,9 +1,14 @@
 # from keras.utils.generic_utils import Progbar
 
+import os
 import sys
 import collections
+import json
 import time
 import numpy as np
+import pandas as pd
+
+from typing import Iterator
 
 
 def clip_read():
@@ -31,6 +36,92 @@ def chunker(seq, size, progbar=True):
             pbar.update(min(pos + size, n))
 
 
+def iter_chunks(source, size, progbar=True):
+    """Yields dataframes of at most ``size`` rows from any of the sources :meth:`~nlpeasy.Pipeline.process` accepts.
+
+    Parameters
+    ----------
+    source :
+        A dataframe, an iterable (e.g. a generator) of dataframes, or the path of a CSV, JSON lines,
+        or Parquet file. Files are read in chunks, hence they do not need to fit in RAM.
+    size :
+        Number of rows per yielded dataframe, only the last one may have less. The dataframes of an iterable
+        are split or combined accordingly.
+    progbar :
+        Display a progress bar. If the number of rows is not known in advance the bar has no target.
+    """
+    if isinstance(source, pd.DataFrame):
+        yield from chunker(source, size, progbar=progbar)
+        return
+    target = None
+    if isinstance(source, (str, os.PathLike)):
+        source, target = read_chunks(source, size)
+    if progbar:
+        pbar: Progbar = Progbar(target)
+        pbar.update(0)
+    # rows of small dataframes wait for the next ones until there are ``size`` of them
+    buffer, buffered = [], 0
+    for df in source:
+        if buffered + len(df) < size:
+            if len(df):
+                buffer.append(df)
+                buffered += len(df)
+            continue
+        if buffer:
+            df = pd.concat(buffer + [df], sort=False)
+            buffer, buffered = [], 0
+        full = len(df) - len(df) % size
+        for chunk in chunker(df.iloc[:full], size, progbar=False):
+            yield chunk
+            if progbar:
+                pbar.add(len(chunk))
+        if full < len(df):
+            buffer, buffered = [df.iloc[full:]], len(df) - full
+    if buffer:
+        chunk = pd.concat(buffer, sort=False) if len(buffer) > 1 else buffer[0]
+        yield chunk
+        if progbar:
+            pbar.add(len(chunk))
+    if progbar and target is None:
+        # finish the line of a bar without target
+        pbar.target = pbar._seen_so_far
+        pbar.update(pbar._seen_so_far)
+
+
+def read_chunks(path, size):
+    """Reads a CSV, JSON lines, or Parquet file in chunks of ``size`` rows.
+
+    Returns
+    -------
+    A tuple of the iterator of dataframes and the total number of rows (``None`` if unknown).
+    The index of the dataframes continues from chunk to chunk as if the whole file was read at once.
+    """
+    path = str(path)
+    suffix = path.lower().rsplit(".", 1)[-1]
+    if suffix in ("csv", "tsv", "txt"):
+        return pd.read_csv(path, chunksize=size, sep="\t" if suffix == "tsv" else ","), None
+    if suffix in ("jsonl", "ndjson", "json"):
+        return pd.read_json(path, lines=True, chunksize=size), None
+    if suffix in ("parquet", "pq"):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise Exception("Please install pyarrow to read parquet files in chunks: pip install pyarrow")
+
+        parquet_file = pq.ParquetFile(path)
+
+        def batches():
+            start = 0
+            for batch in parquet_file.iter_batches(batch_size=size):
+                df = batch.to_pandas()
+                df.index = pd.RangeIndex(start, start + len(df))
+                start += len(df)
+                yield df
+
+        return batches(), parquet_file.metadata.num_rows
+    raise Exception(f"Unknown file type of {path!r}: use one of .csv, .tsv, .jsonl, or .parquet")
+
+
 def insert_with_progbar(
     engine, df, name, if_exists="replace", chunksize=1000, **kwargs
 ):
@@ -257,6 +348,7 @@ class Tictoc(object):
         from collections import defaultdict
 
         self._summarizer = defaultdict(int) if additive else False
+        self._counters = defaultdict(int)
         self._prefix = None
 
     def tic(self, name):
@@ -274,6 +366,15 @@ class Tictoc(object):
         if self._summarizer is not False:
             self._summarizer[name] += dur
 
+    def add(self, name, dur):
+        """Adds a duration in nanoseconds measured elsewhere, e.g. in another thread."""
+        if self._summarizer is not False:
+            self._summarizer[name] += dur
+
+    def count(self, name, n=1):
+        """Adds ``n`` to the counter ``name`` shown in the summary, e.g. for cache hits."""
+        self._counters[name] += n
+
     def clear(self):
         self.stack = []
 
@@ -290,6 +391,136 @@ class Tictoc(object):
             print(f"Warning: stack is not empty but has {len(self.stack)} items")
         for k, v in self._summarizer.items():
             print(f"{k}: {format_time_ns(v)}")
+        for k, v in self._counters.items():
+            print(f"{k}: {v}")
+
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_MISSING = object()
+
+
+def _json_default(v):
+    # what the JSON encoders cannot handle, converted like the Elasticsearch serializer does
+    if hasattr(v, "isoformat"):
+        return v.isoformat()
+    if isinstance(v, np.ndarray):
+        return v.tolist()
+    if isinstance(v, np.generic):
+        return v.item()
+    if isinstance(v, (set, frozenset)):
+        return list(v)
+    raise TypeError(f"Unable to serialize {v!r} (type: {type(v)})")
+
+
+def dumps_json(x) -> bytes:
+    """Encodes ``x`` as compact UTF-8 JSON, with orjson if it is installed (numpy arrays are encoded natively)."""
+    if orjson is not None:
+        return orjson.dumps(x, default=_json_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(x, default=_json_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _is_missing(v):
+    return v is None or v is pd.NA or v is pd.NaT or (isinstance(v, (float, np.floating)) and v != v)
+
+
+def _strip_missing(v):
+    # like rm_nan_from_dict for the values of object columns, numpy arrays are kept as they are
+    if isinstance(v, list):
+        return [_strip_missing(_) for _ in v if not _is_missing(_)]
+    if isinstance(v, dict):
+        return {k: _strip_missing(_) for k, _ in v.items() if not _is_missing(_)}
+    return v
+
+
+def _iso_dates(col, missing, unit=None):
+    # ISO format with seconds, or microseconds if needed; timezone aware dates are written in UTC
+    tz = getattr(col.dtype, "tz", None) is not None
+    if tz:
+        col = col.dt.tz_convert("UTC").dt.tz_localize(None)
+    values = col.to_numpy(dtype="datetime64[us]")
+    if unit is None:
+        unit = "us" if (values[~missing].astype(np.int64) % 1000000).any() else "s"
+    return np.datetime_as_string(values, unit=unit, timezone="UTC" if tz else "naive").tolist()
+
+
+def _column_values(col):
+    """The JSON-ready values of a column as list, with ``_MISSING`` where the value is missing."""
+    if isinstance(col.dtype, pd.CategoricalDtype):
+        col = col.astype(object)
+    if isinstance(col.dtype, np.dtype) and col.dtype.kind in "biu":
+        # cannot have missing values, unlike the nullable Int64 and boolean dtypes
+        return col.tolist()
+    missing = col.isna().to_numpy()
+    if col.dtype.kind == "M":
+        values = _iso_dates(col, missing)
+    elif col.dtype.kind == "O" and not isinstance(col.dtype, pd.StringDtype):
+        values = [_strip_missing(_) if type(_) in (list, dict) else _ for _ in col.tolist()]
+    else:
+        values = col.tolist()
+    if missing.any():
+        values = [_MISSING if m else v for v, m in zip(values, missing)]
+    return values
+
+
+def _canonical(v):
+    # the same value whatever dtype pandas inferred for its column: integral floats become integers
+    if isinstance(v, (float, np.floating)):
+        return int(v) if float(v).is_integer() else float(v)
+    if isinstance(v, np.generic):
+        return v.item()
+    if isinstance(v, (list, tuple, np.ndarray)):
+        return [_canonical(_) for _ in v]
+    if isinstance(v, dict):
+        return {k: _canonical(_) for k, _ in v.items()}
+    return v
+
+
+def canonical_json_rows(df) -> Iterator[bytes]:
+    """The rows of a dataframe as JSON that only depends on their content, e.g. to hash them.
+
+    Unlike :func:`json_docs` the columns are sorted by name, integral floats are written as integers
+    (a column with missing values is float in pandas), and dates always have microseconds.
+    Missing values are left out.
+    """
+    cols = sorted(df.columns, key=str)
+    names = [str(_) for _ in cols]
+    columns = []
+    for c in cols:
+        col = df[c]
+        if col.dtype.kind == "M":
+            missing = col.isna().to_numpy()
+            values = _iso_dates(col, missing, unit="us")
+            columns.append([_MISSING if m else v for v, m in zip(values, missing)])
+        else:
+            columns.append([v if v is _MISSING else _canonical(v) for v in _column_values(col)])
+    if not columns:
+        columns = [[_MISSING] * len(df)]
+        names = [None]
+    for row in zip(*columns):
+        yield dumps_json({k: v for k, v in zip(names, row) if v is not _MISSING})
+
+
+def json_docs(df, suggest_col=None) -> Iterator[bytes]:
+    """The rows of a dataframe as JSON documents without the missing values.
+
+    Missing values are found per column, dates are converted to ISO format once per column,
+    missing values in lists are removed, and numpy arrays (e.g. for ``dense_vector``) are kept as they are.
+    If ``suggest_col`` is given its value is also put in the field ``suggest``.
+    """
+    names = [str(_) for _ in df.columns]
+    columns = [_column_values(df.iloc[:, j]) for j in range(df.shape[1])]
+    if suggest_col is not None and suggest_col in names:
+        names.append("suggest")
+        columns.append(columns[names.index(suggest_col)])
+    if not columns:
+        columns = [[_MISSING] * len(df)]
+        names = [None]
+    for row in zip(*columns):
+        yield dumps_json({k: v for k, v in zip(names, row) if v is not _MISSING})
 
 
 def rm_nan_from_dict(x):
@@ -86,3 +86,605 @@ def test_timerange(elk):
 
     # open Kibana in webbrowser
     # elk.show_kibana()
+
+
+def test_bulk_requests_limits():
+    elk = ne.ElasticStack(set_as_default_stack=False)
+    df = pd.DataFrame({"message": ["a" * 100] * 10, "num": [1.0] * 9 + [float("nan")]})
+
+    requests = list(elk.bulk_requests("test", df, chunksize=4))
+    assert [len(ids) for _, ids in requests] == [4, 4, 2]
+    assert requests[0][1] == ["0", "1", "2", "3"]
+    assert b'"num"' not in requests[-1][0].split(b"\n")[-2]
+
+    requests = list(elk.bulk_requests("test", df, chunksize=100, max_chunk_bytes=400))
+    assert all(len(body) <= 400 for body, _ in requests)
+    assert sum(len(ids) for _, ids in requests) == 10
+
+
+def test_bulk_writer():
+    import re
+    import threading
+    import time
+    from unittest import mock
+
+    requests, lock = [], threading.Lock()
+
+    def bulk(body, **kwargs):
+        time.sleep(0.02)
+        ids = [_.decode() for _ in re.findall(rb'"_id":"([^"]+)"', body)]
+        if "99" in ids:
+            raise RuntimeError("connection lost")
+        with lock:
+            requests.append(ids)
+        return {"items": [{"index": {"_id": _, "status": 400 if _ == "13" else 201}} for _ in ids]}
+
+    elk = ne.ElasticStack(set_as_default_stack=False)
+    elk._es = mock.MagicMock()
+    elk._es.bulk.side_effect = bulk
+    df = pd.DataFrame({"id": range(20), "message": ["text"] * 20})
+    acknowledged = []
+
+    # several requests in flight: every row is sent once, in order within a request
+    writer = ne.BulkWriter(elk, "news", threads=3, queue_size=1, id_col="id", chunksize=3)
+    writer.write(df.iloc[:10], callback=lambda: acknowledged.append("first"))
+    writer.write(df.iloc[10:], callback=lambda: acknowledged.append("second"))
+    result = writer.close()
+    assert sorted(int(_) for ids in requests for _ in ids) == list(range(20))
+    assert all([int(_) for _ in ids] == list(range(int(ids[0]), int(ids[0]) + len(ids))) for ids in requests)
+    assert (result.success, result.failed, result.requests) == (19, 1, 8)
+    # the second frame has the failed document "13"
+    assert acknowledged == ["first"]
+
+    # a full queue makes write wait
+    writer = ne.BulkWriter(elk, "news", threads=1, queue_size=0, id_col="id", chunksize=2)
+    writer.write(df.iloc[:6])
+    writer.close()
+    assert writer.producer_stall > 0 and writer.upload > 0
+
+    # an exception of an upload thread is raised by the next write or by close
+    writer = ne.BulkWriter(elk, "news", threads=1, queue_size=0, id_col="id")
+    writer.write(pd.DataFrame({"id": [99]}), callback=lambda: acknowledged.append("lost"))
+    time.sleep(0.2)
+    with pytest.raises(RuntimeError):
+        writer.write(df.iloc[:1])
+    writer.write(pd.DataFrame({"id": [99]}))
+    with pytest.raises(RuntimeError):
+        writer.close()
+    assert acknowledged == ["first"]
+
+
+def test_json_docs():
+    import json
+    import numpy as np
+
+    df = pd.DataFrame(
+        {
+            "num": [1.5, np.nan],
+            "tags": [["a", None, np.nan], None],
+            "date": pd.to_datetime(["2020-01-02 03:04:05", None]),
+            "vec": [np.array([1, 2], dtype=np.float32), np.array([0, 0], dtype=np.float32)],
+            "count": pd.array([None, 3], dtype="Int64"),
+            "flag": pd.array([True, None], dtype="boolean"),
+        }
+    )
+
+    docs = [json.loads(_) for _ in ne.util.json_docs(df, suggest_col="num")]
+
+    assert docs[0] == {
+        "num": 1.5, "tags": ["a"], "date": "2020-01-02T03:04:05", "vec": [1.0, 2.0], "flag": True, "suggest": 1.5
+    }
+    assert docs[1] == {"vec": [0.0, 0.0], "count": 3}
+    assert len(list(ne.util.canonical_json_rows(df))) == 2
+
+
+def test_ingest_mode():
+    from unittest import mock
+
+    elk = ne.ElasticStack(set_as_default_stack=False)
+    elk._es = mock.MagicMock()
+    elk._es.indices.get_settings.return_value = {"texts": {"settings": {"index": {"number_of_replicas": "1"}}}}
+
+    with pytest.raises(ValueError):
+        with elk.ingest_mode("texts", forcemerge=True):
+            elk._es.indices.put_settings.assert_called_with(
+                index="texts", body={"index": {"refresh_interval": "-1", "number_of_replicas": 0}}
+            )
+            raise ValueError()
+
+    elk._es.indices.put_settings.assert_called_with(
+        index="texts", body={"index": {"refresh_interval": None, "number_of_replicas": "1"}}
+    )
+    elk._es.indices.refresh.assert_called_once_with(index="texts")
+    elk._es.indices.forcemerge.assert_not_called()
+
+
+def test_swap_alias():
+    from unittest import mock
+
+    elk = ne.ElasticStack(set_as_default_stack=False)
+    elk._es = mock.MagicMock()
+    elk._es.indices.exists_alias.return_value = False
+    elk._es.indices.exists.return_value = True
+    versions = ["news-20200101-000000-000000", "news-20210101-000000-000000", "news-20220101-000000-000000"]
+    elk._es.indices.get.return_value = {_: {} for _ in versions + ["news-archive"]}
+
+    elk.swap_alias("news", versions[-1], keep=2)
+
+    elk._es.indices.update_aliases.assert_called_once_with(
+        body={"actions": [{"remove_index": {"index": "news"}}, {"add": {"index": versions[-1], "alias": "news"}}]}
+    )
+    elk._es.indices.delete.assert_called_once_with(index=versions[0])
+    assert elk.versioned_index("news").startswith("news-")
+
+
+def test_process_update_only_changed_rows():
+    from unittest import mock
+    from nlpeasy.pipeline import _content_hashes, CONTENT_HASH_COL
+
+    df = pd.DataFrame({"id": [1, 2, 3], "message": ["a", "b", "c"]})
+    elk = ne.ElasticStack(set_as_default_stack=False)
+    elk._es = mock.MagicMock()
+    elk._es.indices.exists.return_value = True
+    elk._es.mget.return_value = {
+        "docs": [
+            {"_id": "1", "found": True, "_source": {CONTENT_HASH_COL: _content_hashes(df)[0]}},
+            {"_id": "2", "found": True, "_source": {CONTENT_HASH_COL: "changed"}},
+            {"_id": "3", "found": False},
+        ]
+    }
+    elk._es.bulk.return_value = {"items": [{"index": {"status": 201}}] * 2}
+    pipeline = ne.Pipeline(index="news", elk=elk, id_col="id")
+
+    result = pipeline.process(df, progbar=False, if_index_exists="update", write_threads=0)
+
+    assert result["id"].tolist() == [2, 3]
+    body = elk._es.bulk.call_args[1]["body"]
+    assert b'"_id":"2"' in body and b'"_id":"1"' not in body and CONTENT_HASH_COL.encode() in body
+
+
+def test_content_hashes_ignore_chunk_types():
+    from nlpeasy.pipeline import _content_hashes
+
+    row = pd.DataFrame({"id": [1], "year": [2000], "m": ["x"], "d": pd.to_datetime(["2020-01-01"])})
+    # year is float because of the missing value, d has microseconds in the other row, other column order
+    chunk = pd.DataFrame(
+        {
+            "d": pd.to_datetime(["2020-01-01", "2020-01-01 00:00:01.5"], format="ISO8601"),
+            "m": ["x", ["a", None]],
+            "year": [2000, None],
+            "id": [1, 2],
+        }
+    )
+    assert _content_hashes(chunk)[0] == _content_hashes(row)[0]
+    assert _content_hashes(chunk)[1] != _content_hashes(row)[0]
+
+
+def test_resumed_update_keeps_finished_rows(tmp_path):
+    from unittest import mock
+
+    df = pd.DataFrame({"id": range(10), "message": list("abcdefghij")})
+    elk = ne.ElasticStack(set_as_default_stack=False)
+    elk._es = mock.MagicMock()
+    elk._es.indices.exists.return_value = True
+    elk._es.mget.return_value = {"docs": []}
+    elk._es.bulk.side_effect = lambda body, **kwargs: {"items": [{"index": {"status": 201}}] * body.count(b'"index"')}
+    elk.all_ids = lambda index: iter([str(_) for _ in range(10)] + ["gone"])
+    elk.delete_docs = mock.MagicMock(return_value=ne.BulkResult())
+    pipeline = ne.Pipeline(index="news", elk=elk, id_col="id")
+    kwargs = dict(
+        batchsize=3, progbar=False, if_index_exists="update", delete_missing=True, write_threads=0,
+        checkpoint_dir=tmp_path,
+    )
+
+    batches = pipeline.process_iter(df, **kwargs)
+    next(batches), next(batches), next(batches)
+    batches.close()
+    result = pipeline.process(df, **kwargs)
+
+    assert result["id"].tolist() == [6, 7, 8, 9]
+    elk.delete_docs.assert_called_once_with("news", ["gone"])
+
+
+def test_process_streaming_input(tmp_path):
+    df = pd.DataFrame({"message": ["good", "bad", "ugly"] * 10})
+    df.to_csv(tmp_path / "texts.csv", index=False)
+    pipeline = ne.Pipeline(index="news", text_cols=["message"])
+    pipeline += ne.VaderSentiment("message", "sentiment")
+
+    from_csv = pipeline.process(str(tmp_path / "texts.csv"), batchsize=7, progbar=False)
+    from_generator = pipeline.process(
+        (df.iloc[i : i + 12] for i in range(0, len(df), 12)),  # noqa: E203
+        batchsize=7,
+        progbar=False,
+    )
+
+    pd.testing.assert_frame_equal(from_csv, from_generator)
+    assert list(from_csv.index) == list(range(len(df)))
+
+    # small dataframes are combined into full batches
+    small = (df.iloc[i : i + 3] for i in range(0, len(df), 3))  # noqa: E203
+    assert [len(_) for _ in ne.util.iter_chunks(small, 7, progbar=False)] == [7, 7, 7, 7, 2]
+
+
+def test_process_resumes_from_checkpoint(tmp_path):
+    df = pd.DataFrame({"message": ["good", "bad", "ugly"] * 10})
+    pipeline = ne.Pipeline(index="news", text_cols=["message"])
+    pipeline += ne.VaderSentiment("message", "sentiment")
+
+    # the run dies while the consumer handles the second batch: only the first one is done
+    batches = pipeline.process_iter(df, batchsize=7, progbar=False, checkpoint_dir=tmp_path)
+    next(batches), next(batches)
+    batches.close()
+    assert 0 in ne.Checkpoint(tmp_path, 7, "news") and 1 not in ne.Checkpoint(tmp_path, 7, "news")
+    with pytest.raises(Exception):
+        ne.Checkpoint(tmp_path, 10, "news")
+
+    resumed = pipeline.process(df, batchsize=7, progbar=False, checkpoint_dir=tmp_path)
+    assert list(resumed.index) == list(range(7, len(df)))
+    assert pipeline.stats["sentiment"].count == len(df)
+    assert len(ne.Checkpoint(tmp_path, 7, "news")) == 0
+
+
+def test_process_file_results_on_failure_and_resume(tmp_path):
+    class FailOnce(ne.pipeline.PipelineStage):
+        failed = False
+
+        def new_columns(self, text):
+            if "stop" in text["message"].tolist() and not FailOnce.failed:
+                FailOnce.failed = True
+                raise ValueError("stop")
+            return {"length": text["message"].str.len()}
+
+    df = pd.DataFrame({"message": ["a", "bb", "ccc", "stop", "e"]})
+    pipeline = ne.Pipeline(index="news", text_cols=["message"])
+    pipeline += FailOnce()
+
+    # without a checkpoint the file is still readable and has the batches before the failure
+    with pytest.raises(ValueError):
+        pipeline.process(df, batchsize=2, progbar=False, return_processed=str(tmp_path / "r.parquet"))
+    assert pd.read_parquet(tmp_path / "r.parquet")["length"].tolist() == [1, 2]
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["r.parquet"]
+
+    # with a checkpoint the resumed run also writes the batches of the failed one
+    FailOnce.failed = False
+    checkpoint_dir = tmp_path / "checkpoint"
+    with pytest.raises(ValueError):
+        pipeline.process(
+            df, batchsize=2, progbar=False, return_processed=str(tmp_path / "r.arrow"), checkpoint_dir=checkpoint_dir
+        )
+    table = pipeline.process(
+        df, batchsize=2, progbar=False, return_processed=str(tmp_path / "r.arrow"), checkpoint_dir=checkpoint_dir
+    ).to_pandas()
+    assert table["length"].tolist() == [1, 2, 3, 4, 1] and list(table.index) == list(df.index)
+    assert list(checkpoint_dir.iterdir()) == []
+
+
+def test_process_n_workers():
+    df = pd.DataFrame({"message": ["good", "bad", "ugly", "a fine day"] * 5}, index=[f"r{i}" for i in range(20)])
+    results = []
+    for n_workers in [0, 2]:
+        pipeline = ne.Pipeline(index="news", text_cols=["message"])
+        pipeline += ne.VaderSentiment("message", "sentiment", n_process=2)
+        if n_workers:
+            # the pool of the stage would keep the workers from shutting down
+            with pytest.warns(UserWarning, match="n_process"):
+                results.append(pipeline.process(df, batchsize=6, progbar=False, n_workers=n_workers))
+        else:
+            results.append(pipeline.process(df, batchsize=6, progbar=False, n_workers=n_workers))
+        assert pipeline._pipeline[0]._pool is None
+    pd.testing.assert_frame_equal(results[0], results[1])
+    assert list(results[1].index) == list(df.index)
+
+
+def test_process_iter_and_sinks(tmp_path):
+    df = pd.DataFrame({"message": ["no tag"] * 5 + ["a $tag$", "$x$ and $y$", "none"]}, index=list("abcdefgh"))
+    pipeline = ne.Pipeline(index="news", text_cols=["message"])
+    pipeline += ne.RegexTag(r"\$([^$]+)\$", "message", "tags")
+
+    batches = list(pipeline.process_iter(df, batchsize=5, progbar=False))
+    assert [len(_) for _ in batches] == [5, 3]
+    expected = pd.concat(batches)
+
+    # the first batch has only empty tag lists, hence another schema than the second one
+    path = pipeline.process(df, batchsize=5, progbar=False, return_processed=str(tmp_path / "r.parquet"))
+    assert path == str(tmp_path / "r.parquet")
+    assert pd.read_parquet(path)["tags"].map(list).tolist() == expected["tags"].tolist()
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["r.parquet"]
+
+    # a column that only appears in a later batch is kept, with nulls before
+    sink = ne.ArrowSink(tmp_path / "r.arrow")
+    sink.write(pd.DataFrame({"n": [1, 2]}, index=[0, 1]))
+    sink.write(pd.DataFrame({"n": [3.5], "entity_x": [["E"]]}, index=[2]))
+    table = sink.close().to_pandas()
+    assert table["n"].tolist() == [1.0, 2.0, 3.5]
+    assert table["entity_x"].tolist()[:2] == [None, None] and list(table["entity_x"][2]) == ["E"]
+    assert list(table.index) == [0, 1, 2]
+
+
+def test_stage_columns_added_in_one_step():
+    import warnings
+    import numpy as np
+
+    class Many(ne.pipeline.PipelineStage):
+        def new_columns(self, text):
+            columns = {f"num_{i}": np.full(len(text), i) for i in range(150)}
+            columns["shuffled"] = pd.Series(["b", "a"], index=text.index[::-1])
+            columns["tags"] = [["x"], []]
+            return columns
+
+    class Whole(ne.pipeline.PipelineStage):
+        # stages overriding process get and return the whole frame
+        def process(self, text):
+            return text.assign(whole=text["num_1"] + 1)
+
+    df = pd.DataFrame({"message": ["x", "y"], "n": [1.0, 2.0]}, index=[7, 3])
+    pipeline = ne.Pipeline(index="news")
+    pipeline += Many()
+    pipeline += Whole()
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", pd.errors.PerformanceWarning)
+        result = pipeline.process(df, progbar=False)
+
+    assert list(result.columns[:4]) == ["message", "n", "num_0", "num_1"] and result["num_149"].tolist() == [149, 149]
+    assert result["shuffled"].tolist() == ["a", "b"] and result["tags"].tolist() == [["x"], []]
+    assert result["whole"].tolist() == [2, 2] and list(result.index) == [7, 3]
+    assert list(df.columns) == ["message", "n"]
+
+
+def test_stats_collector():
+    stats = ne.StatsCollector(num_cols=["num"], tag_cols=["tag"], sample_size=50)
+    df = pd.DataFrame({"num": [float(i) for i in range(100)], "tag": [["a"], ["a", "b"], [], None] * 25})
+    for i in range(0, 100, 30):
+        stats.update(df.iloc[i : i + 30])  # noqa: E203
+
+    assert stats.min_max() == {"num": (0.0, 99.0)}
+    assert 20 < stats["num"].quantile(0.5) < 80
+    assert stats["tag"].top(2) == [("a", 50), ("b", 25)]
+    assert stats["tag"].null_rate == 0.5
+
+
+def test_spacy_enrichment_extract():
+    import spacy
+    from spacy.tokens import Doc
+
+    nlp = spacy.blank("en")
+    doc = Doc(
+        nlp.vocab,
+        words=["Anna", "likes", "Bob", "today", "."],
+        pos=["PROPN", "VERB", "PROPN", "NOUN", "PUNCT"],
+        deps=["nsubj", "ROOT", "dobj", "npadvmod", "punct"],
+        heads=[1, 1, 1, 1, 1],
+        lemmas=["Anna", "like", "Bob", "today", "."],
+        sent_starts=[True, False, False, False, False],
+        ents=["B-PERSON", "O", "B-PERSON", "B-DATE", "O"],
+    )
+    stage = ne.SpacyEnrichment(nlp, cols=["message"])
+
+    ret = stage._extract(doc)
+
+    assert ret["wc"] == 5 and ret["sentence_count"] == 1 and ret["_sents"] == [(0, 22)]
+    assert ret["entity_PERSON"] == ["Anna", "Bob"] and ret["entity_DATE"] == ["today"]
+    assert ret["ents"] == ["Anna", "Bob"]
+    assert ret["subj"] == ["Anna"] and ret["verb"] == ["like"]
+    assert ret["num_PROPN"] == 2 and ret["num_VERB"] == 1 and "num_ADJ" not in ret
+
+
+def test_enrichment_cache(tmp_path):
+    cache = ne.EnrichmentCache(tmp_path / "cache.sqlite", max_entries=3)
+    keys = [ne.EnrichmentCache.key(text, "model") for text in "abcd"]
+    cache.put_many({k: {"wc": i} for i, k in enumerate(keys[:3])})
+    assert cache.get_many(keys[:1]) == {keys[0]: {"wc": 0}}
+
+    cache.put_many({keys[3]: {"wc": 3}})
+
+    assert len(cache) == 3
+    assert set(cache.get_many(keys)) == {keys[0], keys[2], keys[3]}
+    assert (cache.hits, cache.misses) == (4, 1)
+
+
+def test_regex_tag_columns():
+    df = pd.DataFrame(
+        {"message": ["a 12 b 3", "no digits", None], "title": ["7", None, "8"]},
+        index=[10, 20, 30],
+    )
+    pipeline = ne.Pipeline(index="news", text_cols=["message"])
+    pipeline += ne.RegexTag(r"\d+", ["message", "title"], "nums")
+
+    result = pipeline.process(df, progbar=False)
+
+    assert result["nums"].tolist() == [["12", "3", "7"], [], ["8"]]
+
+    # a chunk in which a column has no strings at all
+    df["title"] = float("nan")
+    assert pipeline.process(df, progbar=False)["nums"].tolist() == [["12", "3"], [], []]
+
+
+def test_multi_regex_tag():
+    import re
+
+    patterns = {"doi": r"doi:[^ ]+", "ticket": r"#(\d+)", "pair": r"(\w)=(\w)?;", "double": r"(a)\1"}
+    text = "see doi:10.1/x and #12, #7 k=v; q=; aa"
+    pipeline = ne.Pipeline(index="news")
+    pipeline += ne.MultiRegexTag(patterns, ["message"])
+
+    result = pipeline.process(pd.DataFrame({"message": [text, None]}), progbar=False)
+
+    for col, pattern in patterns.items():
+        assert result[col].tolist() == [re.findall(pattern, text), []]
+
+    # a conditional group refers to the group number in the pattern itself
+    patterns = {"a": r"y(\d)", "tag": r"(<)?(\w+)(?(1)>)"}
+    text = "<b> c <d"
+    pipeline = ne.Pipeline(index="news")
+    pipeline += ne.MultiRegexTag(patterns, ["message"])
+    result = pipeline.process(pd.DataFrame({"message": [text]}), progbar=False)
+    for col, pattern in patterns.items():
+        assert result[col].tolist() == [re.findall(pattern, text)]
+
+
+def test_vader_sentiment_batched():
+    from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+
+    df = pd.DataFrame({"message": ["I love this!", "This is terrible.", "ok", None] * 3})
+    results = []
+    for n_process in [1, 2]:
+        pipeline = ne.Pipeline(index="news")
+        pipeline += ne.VaderSentiment("message", "sentiment", scores=True, n_process=n_process)
+        results.append(pipeline.process(df, batchsize=4, progbar=False))
+        assert pipeline._pipeline[0]._pool is None
+        # each distinct text is scored once, in the first batch
+        assert pipeline._tictoc._counters["VaderSentiment / memo hits"] == 8
+        # the memo does not keep the texts
+        assert [len(_) for _ in pipeline._pipeline[0]._memo] == [16] * 4
+    pd.testing.assert_frame_equal(results[0], results[1])
+
+    expected = SentimentIntensityAnalyzer().polarity_scores("This is terrible.")
+    assert results[0]["sentiment"][1] == expected["compound"]
+    assert results[0]["sentiment_neg"][5] == expected["neg"]
+
+
+def test_vader_sentence_granularity():
+    text = "I love this. This is terrible!"
+    pipeline = ne.Pipeline(index="news")
+    pipeline += ne.VaderSentiment("message", "sentiment", granularity="sentence")
+
+    result = pipeline.process(pd.DataFrame({"message": [text, text, "ok"]}), progbar=False)
+
+    good, bad = (ne.pipeline._vader_scores(_, ["compound"])[0] for _ in ["I love this.", "This is terrible!"])
+    assert result["sentiment"][0] == pytest.approx((good + bad) / 2)
+    assert result["sentiment_min"][1] == bad and result["sentiment_max"][1] == good
+    assert result["sentiment_neg_share"].tolist() == [0.5, 0.5, 0.0]
+    assert "sentiment_neg_share" in pipeline._numCols
+
+
+def test_doc_store_parses_once():
+    import spacy
+
+    nlp = spacy.blank("en")
+    nlp.add_pipe("sentencizer")
+    parsed = []
+    pipe = nlp.pipe
+    nlp.pipe = lambda texts, **kwargs: (parsed.append(doc) or doc for doc in pipe(texts, **kwargs))
+    pipeline = ne.Pipeline(index="news")
+    pipeline += ne.SpacyEnrichment(nlp, "message", tags=["ents"])
+    pipeline += ne.SpacyEnrichment(nlp, "message", tags=["verb"])
+    parsed.clear()  # warm up
+
+    result = pipeline.process(pd.DataFrame({"message": ["One. Two.", "Three"]}), progbar=False)
+
+    assert len(parsed) == 2
+    assert result["message_sentence_count"].tolist() == [2, 1]
+    assert pipeline.docs.get("message") is None
+
+
+def test_doc_store_keeps_docs_only_if_needed(tmp_path):
+    import spacy
+
+    class Probe(ne.pipeline.PipelineStage):
+        def __init__(self, needs_docs):
+            super(Probe, self).__init__()
+            self._needs_docs = needs_docs
+            self.docs = []
+
+        def needs_docs(self, col):
+            return self._needs_docs
+
+        def new_columns(self, text):
+            self.docs.append(self._pipeline.docs.get("message"))
+            return {}
+
+    nlp = spacy.blank("en")
+    nlp.add_pipe("sentencizer")
+    for needs_docs in [False, True]:
+        probe = Probe(needs_docs)
+        pipeline = ne.Pipeline(index="news")
+        pipeline += ne.SpacyEnrichment(nlp, "message")
+        pipeline += probe
+        pipeline.process(pd.DataFrame({"message": ["One. Two.", "Three"]}), progbar=False)
+        if needs_docs:
+            assert [doc.text for doc in probe.docs[0]] == ["One. Two.", "Three"]
+        else:
+            assert probe.docs == [None]
+
+    # stages loading the same model by name share it
+    nlp.to_disk(tmp_path / "model")
+    first, second = (ne.SpacyEnrichment(str(tmp_path / "model"), "message", tags=["ents"]) for _ in range(2))
+    assert first._nlp is second._nlp
+
+
+def test_spacy_enrichment_selects_pipes():
+    import spacy
+
+    nlp = spacy.blank("en")
+    nlp.add_pipe("sentencizer")
+    stage = ne.SpacyEnrichment(nlp, "message", tags=["ents"], pos_stats=False)
+    components = ["tok2vec", "tagger", "attribute_ruler", "senter", "parser", "ner", "lemmatizer"]
+
+    assert stage._unneeded_pipes(components) == ["parser", "tagger", "attribute_ruler", "lemmatizer"]
+    stage._tags = ["subj"]
+    assert stage._unneeded_pipes(components) == ["ner", "senter"]
+
+
+def test_spacy_enrichment_token_batches():
+    import spacy
+
+    nlp = spacy.blank("en")
+    nlp.add_pipe("sentencizer")
+    texts = ["a b c d e f", "a", "a b c", "a b"]
+    stage = ne.SpacyEnrichment(nlp, "message", max_batch_tokens=4, batch_size=10)
+
+    assert stage._batches(texts, [0, 1, 2, 3]) == [([1, 3], 2), ([2], 1), ([0], 1)]
+
+    # each doc is extracted before the next one is parsed, so only one batch of docs is alive at a time
+    events = []
+    pipe, extract = nlp.pipe, stage._extract
+    nlp.pipe = lambda texts, **kwargs: (events.append("parse") or doc for doc in pipe(texts, **kwargs))
+    stage._extract = lambda doc, *args: events.append("extract") or extract(doc, *args)
+    pipeline = ne.Pipeline(index="news")
+    pipeline += stage
+    result = pipeline.process(pd.DataFrame({"message": texts}), progbar=False)
+    assert result["message_wc"].tolist() == [6, 1, 3, 2]
+    assert events == ["parse", "extract"] * 4
+
+
+def test_spacy_enrichment_windows():
+    import spacy
+    from nlpeasy.pipeline import _text_windows
+
+    text = ("Anna meets Bob. He is at home today! " * 30 + "\n\n") * 5
+    windows = _text_windows(text, 500, 50)
+    assert windows[0][2] == 0 and windows[-1][3] == len(text)
+    assert all(a[3] == b[2] and a[3] - a[2] <= 500 for a, b in zip(windows, windows[1:]))
+
+    nlp = spacy.blank("en")
+    nlp.add_pipe("sentencizer")
+    results = []
+    for kwargs in [{}, {"max_window_chars": 500, "window_overlap": 50}]:
+        pipeline = ne.Pipeline(index="news")
+        pipeline += ne.SpacyEnrichment(nlp, "message", **kwargs)
+        results.append(pipeline.process(pd.DataFrame({"message": [text, "Short."]}), progbar=False))
+    pd.testing.assert_frame_equal(results[0], results[1])
+
+
+def test_spacy_enrichment_process_pool():
+    import spacy
+
+    nlp = spacy.blank("en")
+    nlp.add_pipe("sentencizer")
+    texts = pd.DataFrame({"message": ["One. Two.", "Three", "Four five. Six. Seven."] * 3})
+    results = []
+    for n_process in [1, 2]:
+        pipeline = ne.Pipeline(index="news")
+        pipeline += ne.SpacyEnrichment(nlp, "message", n_process=n_process)
+        results.append(pipeline.process(texts, progbar=False))
+        assert pipeline._pipeline[0]._pool is None
+    pd.testing.assert_frame_equal(results[0], results[1])
+
+    # inside the workers of n_workers the stage parses in-process, so the workers can shut down
+    with pytest.warns(UserWarning, match="n_process"):
+        in_workers = pipeline.process(texts, batchsize=4, progbar=False, n_workers=2)
+    pd.testing.assert_frame_equal(results[0], in_workers)
+
+    with pytest.warns(DeprecationWarning):
+        assert ne.SpacyEnrichment(nlp, "message", n_threads=3)._n_process == 3